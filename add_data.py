@@ -1,17 +1,124 @@
 import os
 import shutil
 import sys
+import time
 from tqdm import tqdm
 from dotenv import load_dotenv
 from extractor import FeatureExtractor, FEATURE_DIMENSION, MODEL_NAME
 from milvus_db import MilvusManager
-from import_data import DATA_DIR, BATCH_SIZE
+from import_data import DATA_DIR, BATCH_SIZE, folder_category
+from manifest import ImportManifest, file_hash, acquire_lock, lock_manifest, wait_message
+from embedding_cache import EmbeddingCache, embed_tasks
+from dedup import find_near_duplicates
+from metrics import STAGE_SECONDS, observe_stages
 
 load_dotenv()
 
 ADD_DIR = os.getenv('ADD_DIR', 'add-data')
 
-def process_add_data(milvus_manager=None, extractor=None):
+def lock_add_dir(on_wait=None):
+    """Blocks until no other add run (API job queue or CLI) is working on ADD_DIR; returns the open lock file."""
+    os.makedirs(ADD_DIR, exist_ok=True)
+    return acquire_lock(os.path.join(ADD_DIR, ".lock"), on_wait=on_wait)
+
+def lock_uploads(shared=False):
+    """
+    Held shared by add-image while it saves an upload and queues its job,
+    and exclusively by a run while it collects or sweeps ADD_DIR, so a run
+    never removes a folder an upload is about to fill and every collected
+    file already has its job recorded.
+    """
+    os.makedirs(ADD_DIR, exist_ok=True)
+    return acquire_lock(os.path.join(ADD_DIR, ".uploads.lock"), shared=shared)
+
+def move_to_data_dir(task):
+    dest_folder = os.path.join(DATA_DIR, task['category'], task['name_key'])
+    if not os.path.exists(dest_folder):
+        os.makedirs(dest_folder)
+
+    dest_path = os.path.join(dest_folder, task['filename'])
+
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+        shutil.move(task['path'], dest_path)
+        print(f"⚠️ Overwritten existing file: {task['filename']}")
+
+    else:
+        shutil.move(task['path'], dest_path)
+
+    return dest_path
+
+def check_catalog_name(value, what="name"):
+    """Rejects anything that is not a single path component, so request values cannot leave DATA_DIR."""
+    if not value or value in (".", "..") or any(char in value for char in ("/", "\\", "\0", os.sep)):
+        raise ValueError(f"Invalid {what} '{value}'")
+    return value
+
+def inside_data_dir(path) -> bool:
+    root = os.path.realpath(DATA_DIR)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+def remove_from_catalog(milvus_manager, name_key, filename=None, category=None):
+    """
+    Deletes a name_key group, or one `filename` of it, from DATA_DIR, the
+    collection and the import manifest. Without `category` the group is
+    removed from every category it appears in. Only the image files directly
+    inside the group folder belong to the group (see `folder_category`), so
+    nested folders are never touched.
+    """
+    check_catalog_name(name_key, "name_key")
+    if filename is not None:
+        check_catalog_name(filename, "filename")
+    if category:
+        check_catalog_name(category, "category")
+
+    if category:
+        folders = [os.path.join(category, name_key)]
+    elif os.path.isdir(DATA_DIR):
+        folders = [
+            os.path.join(entry, name_key) for entry in sorted(os.listdir(DATA_DIR))
+            if os.path.isdir(os.path.join(DATA_DIR, entry, name_key))
+        ]
+        flat = os.path.join(DATA_DIR, name_key)
+        # A top-level folder with subfolders is a category, not a flat name_key group.
+        if os.path.isdir(flat) and not any(entry.is_dir() for entry in os.scandir(flat)):
+            folders.insert(0, name_key)
+    else:
+        folders = []
+
+    removed_paths = []
+    for folder in folders:
+        folder_path = os.path.join(DATA_DIR, folder)
+        if not os.path.isdir(folder_path) or not inside_data_dir(folder_path):
+            continue
+        files = [filename] if filename is not None else sorted(os.listdir(folder_path))
+        for file in files:
+            path = os.path.join(folder_path, file)
+            if os.path.isfile(path) and not os.path.islink(path) and inside_data_dir(path):
+                os.remove(path)
+                removed_paths.append(os.path.join(folder, file))
+        if filename is None:
+            try:
+                os.rmdir(folder_path)
+            except OSError:
+                pass
+
+    if filename is not None:
+        deleted = milvus_manager.delete_by_filename(filename, name_key, category)
+    else:
+        deleted = milvus_manager.delete_by_name_key(name_key, category)
+    ImportManifest().remove(removed_paths)
+
+    print(f">>> Removed {len(removed_paths)} files and {deleted} vectors for '{name_key}'"
+          f"{f' / {filename}' if filename else ''}.", flush=True)
+    return {"deleted_file_count": len(removed_paths), "deleted_vector_count": deleted}
+
+def process_add_data(milvus_manager=None, extractor=None, progress_callback=None, on_collected=None):
+    """
+    Embeds and moves everything in ADD_DIR into DATA_DIR. `on_collected` is
+    called with the collected tasks while uploads are still locked out,
+    e.g. to claim the jobs those uploads were queued under.
+    """
     print(f"\n>>> 🔄 STARTING ADD DATA PROCESS...", flush=True)
 
     if milvus_manager is None:
@@ -19,7 +126,7 @@ def process_add_data(milvus_manager=None, extractor=None):
             milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
         except Exception as e: 
             print(f"❌ Error connecting to Milvus: {e}") 
-            print("⚠️  Hint: Stop 'service.py' before running this script manually.") 
+            print("⚠️  Hint: start 'python vector_store.py serve' to share the database with the running API.") 
             return {"status": "error", "message": "Database locked"} 
     
     if extractor is None:
@@ -35,17 +142,23 @@ def process_add_data(milvus_manager=None, extractor=None):
         os.makedirs(DATA_DIR)
 
     tasks = []
-    for root, dirs, files in os.walk(ADD_DIR):
-        current_name_key = os.path.basename(root)
-        if root == ADD_DIR: continue
+    with lock_uploads():
+        for root, dirs, files in os.walk(ADD_DIR):
+            current_name_key = os.path.basename(root)
+            if root == ADD_DIR: continue
+            category = folder_category(os.path.relpath(root, ADD_DIR))
 
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-                tasks.append({
-                    "path": os.path.join(root, file),
-                    "name_key": current_name_key,
-                    "filename": file
-                })
+            for file in files:
+                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
+                    tasks.append({
+                        "path": os.path.join(root, file),
+                        "rel_path": os.path.join(category, current_name_key, file),
+                        "name_key": current_name_key,
+                        "filename": file,
+                        "category": category,
+                    })
+        if on_collected:
+            on_collected(tasks)
 
     if not tasks:
         print(f">>> No new images found in '{ADD_DIR}'.", flush=True)
@@ -55,61 +168,113 @@ def process_add_data(milvus_manager=None, extractor=None):
     
     count_added = 0
     count_moved = 0
-    batch_data = []
-
-    for task in tqdm(tasks, desc="Adding"):
-        try:
-            file_path = task['path']
-            filename = task['filename']
-            name_key = task['name_key']
-            
-            if not milvus_manager.check_file_exists(filename):
-                vector = extractor(file_path)
-                if vector:
-                    batch_data.append({
-                        "vector": vector,
-                        "name_key": name_key,
-                        "filename": filename
-                    })
-                    count_added += 1
-            
-            if len(batch_data) >= BATCH_SIZE: 
-                milvus_manager.insert_batch(batch_data) 
-                batch_data = [] 
-
-            dest_folder = os.path.join(DATA_DIR, name_key)
-            if not os.path.exists(dest_folder):
-                os.makedirs(dest_folder)
-            
-            dest_path = os.path.join(dest_folder, filename)
-            
-            if os.path.exists(dest_path):
-                os.remove(dest_path)
-                shutil.move(file_path, dest_path)
-                print(f"⚠️ Overwritten existing file: {filename}")
-
-            else:
-                shutil.move(file_path, dest_path)
-            
-            count_moved += 1
-
-        except Exception as e:
-            print(f"Error processing {task['filename']}: {e}")
-
-    if batch_data:
-        milvus_manager.insert_batch(batch_data)
-
-    for root, dirs, files in os.walk(ADD_DIR, topdown=False):
-        for name in dirs:
+    count_replaced = 0
+    count_duplicates = 0
+    manifest = ImportManifest()
+    known = manifest.get([task['rel_path'] for task in tasks])
+    cache = EmbeddingCache(FEATURE_DIMENSION)
+
+    stored_ids = {}
+    try:
+        with STAGE_SECONDS.time(endpoint="add_image", stage="dedup"):
+            for row in milvus_manager.file_rows([(task['name_key'], task['filename']) for task in tasks]):
+                key = (row.get('category') or "", row.get('name_key'), row.get('filename'))
+                stored_ids.setdefault(key, []).append(row['id'])
+    except Exception as e:
+        print(f"Check exists error: {e}")
+
+    with tqdm(total=len(tasks), desc="Adding") as pbar:
+        for start in range(0, len(tasks), BATCH_SIZE):
+            batch_tasks = tasks[start:start + BATCH_SIZE]
+
             try:
-                os.rmdir(os.path.join(root, name))
-            except: pass
+                with STAGE_SECONDS.time(endpoint="add_image", stage="hash"):
+                    for task in batch_tasks:
+                        task['sha1'] = file_hash(task['path'])
+
+                # An upload over an already-embedded file keeps the stored vector
+                # only if the content is unchanged; otherwise it is replaced.
+                new_tasks = []
+                for task in batch_tasks:
+                    entry = known.get(task['rel_path'])
+                    old_ids = stored_ids.get((task['category'], task['name_key'], task['filename']), [])
+                    if entry and entry['sha1'] == task['sha1'] and old_ids:
+                        task['ids'] = entry['ids']
+                        continue
+                    task['old_ids'] = sorted(set(old_ids) | set(entry['ids'] if entry else []))
+                    new_tasks.append(task)
+
+                timings = {}
+                ok_tasks, vectors, failed = embed_tasks(new_tasks, extractor, cache, timings=timings)
+                observe_stages("add_image", timings)
+                for index, error in failed.items():
+                    print(f"Error processing {new_tasks[index]['filename']}: {error}")
+
+                with STAGE_SECONDS.time(endpoint="add_image", stage="near_duplicate"):
+                    duplicates = find_near_duplicates(milvus_manager, ok_tasks, vectors)
+                for index, original in duplicates.items():
+                    print(f"⚠️ {ok_tasks[index]['filename']} duplicates {original['name_key']}/{original['filename']} "
+                          f"({original['score']}), not indexed")
+                    ok_tasks[index]['ids'] = []
+                keep = [index for index in range(len(ok_tasks)) if index not in duplicates]
+                new_tasks = [ok_tasks[index] for index in keep]
+
+                with STAGE_SECONDS.time(endpoint="add_image", stage="insert"):
+                    res = milvus_manager.upsert_batch({
+                        "vector": vectors[keep],
+                        "name_key": [task['name_key'] for task in new_tasks],
+                        "filename": [task['filename'] for task in new_tasks],
+                        "category": [task['category'] for task in new_tasks],
+                        "content_hash": [task['sha1'] for task in new_tasks],
+                    }, old_ids=[i for task in new_tasks for i in task['old_ids']])
+                    # A file overwritten with a near-duplicate keeps no vector at all.
+                    milvus_manager.delete_ids([i for index in duplicates for i in ok_tasks[index]['old_ids']])
+                for task, new_id in zip(new_tasks, res.get("ids", [])):
+                    task['ids'] = [new_id]
+                count_added += len(new_tasks)
+                count_duplicates += len(duplicates)
+                count_replaced += sum(1 for task in new_tasks if task['old_ids'])
+            except Exception as e:
+                print(f"Error adding batch: {e}")
+
+            post_start = time.perf_counter()
+            manifest_entries = []
+            for task in batch_tasks:
+                try:
+                    dest_path = move_to_data_dir(task)
+                    count_moved += 1
+                    if 'ids' in task:
+                        stat = os.stat(dest_path)
+                        manifest_entries.append((
+                            os.path.relpath(dest_path, DATA_DIR), stat.st_size, stat.st_mtime,
+                            task['sha1'], task['ids']
+                        ))
+                except Exception as e:
+                    print(f"Error processing {task['filename']}: {e}")
+            manifest.record(manifest_entries)
+            STAGE_SECONDS.observe(time.perf_counter() - post_start, endpoint="add_image", stage="post_process")
+
+            pbar.update(len(batch_tasks))
+            if progress_callback:
+                progress_callback(pbar.n, len(tasks))
+
+    with lock_uploads():
+        for root, dirs, files in os.walk(ADD_DIR, topdown=False):
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except: pass
 
     print(f"✅ PROCESS COMPLETE.")
-    print(f"   - Added to DB: {count_added}")
+    print(f"   - Added to DB: {count_added} ({count_replaced} replacing older vectors)")
+    print(f"   - Near-duplicates not indexed: {count_duplicates}")
     print(f"   - Moved to Train: {count_moved}", flush=True)
     
-    return {"added_file_count": count_added, "moved_file_count": count_moved}
+    return {"added_file_count": count_added, "replaced_file_count": count_replaced,
+            "duplicate_file_count": count_duplicates, "moved_file_count": count_moved}
 
 if __name__ == "__main__":
-    process_add_data()
\ No newline at end of file
+    # Same locks, in the same order, as the API's AddJobQueue runs.
+    with lock_add_dir(on_wait=wait_message("the running add job")), \
+            lock_manifest(wait=True, on_wait=wait_message("the running import")):
+        process_add_data()
\ No newline at end of file
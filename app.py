@@ -1,13 +1,25 @@
 import os
+import io
+import functools
 import math
+import time
 import warnings
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from PIL import Image, ImageDraw
 from dotenv import load_dotenv
 from extractor import FeatureExtractor, FEATURE_DIMENSION, MODEL_NAME
-from milvus_db import MilvusManager
-from import_data import run_import, DATA_DIR
-from add_data import process_add_data, ADD_DIR
+from milvus_db import MilvusManager, build_filter
+from search_batcher import SearchBatcher
+from jobs import AddJobQueue, ImportRunner
+from manifest import lock_manifest
+from result_cache import ResultCache
+from fusion import mean_embedding, reciprocal_rank_fusion, FUSION_MODES
+from import_data import DATA_DIR
+from add_data import ADD_DIR, remove_from_catalog, check_catalog_name, lock_uploads
+from profiling import profile_call, ProfilerBusy, PROFILING_ENABLED, PROFILE_MODES
+from startup import StartupController, warm_up
+from metrics import (REGISTRY, REQUESTS, ERRORS, IN_FLIGHT, REQUEST_SECONDS, STAGE_SECONDS,
+                     COLLECTION_ENTITIES, MODEL_LOAD_SECONDS)
 
 load_dotenv()
 
@@ -15,55 +27,210 @@ warnings.filterwarnings("ignore", category=UserWarning, module='milvus_lite')
 
 PORT = int(os.getenv('PORT', 51200))
 
-print(">>> Initializing Milvus & Extractor...", flush=True)
-extractor = FeatureExtractor()
-print(">>> Initializing Milvus Connection...", flush=True)
-milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
+extractor = None
+milvus_manager = None
+search_batcher = None
+add_job_queue = None
+import_runner = None
+result_cache = ResultCache()
+startup = StartupController()
 
-if not milvus_manager.has_data():
-    print(">>> DB Check: EMPTY. Starting Import...", flush=True)
-    run_import(milvus_manager)
-else:
-    print(">>> DB Check: DATA EXISTS. Skipping Import.", flush=True)
+def load_model(start_session=True):
+    global extractor
+    if extractor is None:
+        start = time.perf_counter()
+        extractor = FeatureExtractor(start_session=start_session)
+        MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+    if start_session:
+        extractor.start_session()
+
+def connect_milvus():
+    global milvus_manager
+    milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
+
+def start_workers():
+    global search_batcher, add_job_queue, import_runner
+    search_batcher = SearchBatcher(extractor, milvus_manager)
+    add_job_queue = AddJobQueue(milvus_manager, extractor, on_complete=result_cache.invalidate)
+    import_runner = ImportRunner(milvus_manager, extractor, on_complete=result_cache.invalidate)
+    # Imports an empty or half-imported collection in the background; searches
+    # are served from whatever is already indexed in the meantime.
+    import_runner.start(reason="startup")
+
+def init_worker():
+    """
+    Starts this process's startup sequence in the background (after fork
+    under gunicorn) and returns immediately, so the server binds and answers
+    liveness checks while the model and Milvus come up.
+    """
+    REGISTRY.start_flusher()
+    startup.start([
+        ("loading_model", load_model),
+        ("connecting", connect_milvus),
+        ("starting_workers", start_workers),
+        ("warming_up", lambda: warm_up(extractor, milvus_manager)),
+    ])
+
+def collect_entity_count():
+    if milvus_manager is not None:
+        COLLECTION_ENTITIES.set(milvus_manager.count())
+
+REGISTRY.add_collector(collect_entity_count)
+
+# gunicorn.conf.py sets PRELOAD_MODEL with several workers: loading the
+# model in the master before fork lets workers share its weights, at the
+# cost of binding only after the load. The onnxruntime session is not
+# fork-safe, so each worker creates it in init_worker.
+if os.getenv('PRELOAD_MODEL') == '1':
+    print(">>> Preloading Extractor...", flush=True)
+    load_model(start_session=False)
+
+if os.getenv('DEFER_WORKER_INIT') != '1':
+    init_worker()
 
 app = Flask(__name__)
 
+MAX_TOP_K_GROUPS = 100
+MAX_HITS_PER_GROUP = 20
+MAX_IMAGES_PER_REQUEST = 16
+RRF_CANDIDATE_FACTOR = 3
+
+def requires_ready(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not startup.ready:
+            response = jsonify({"status_code": 503, "message": f"Service is starting ({startup.phase})", "data": None})
+            return response, 503, {"Retry-After": "5"}
+        return view(*args, **kwargs)
+    return wrapper
+
+def int_param(name, default, low, high):
+    value = request.values.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+    if not low <= value <= high:
+        raise ValueError(f"'{name}' must be between {low} and {high}")
+    return value
+
+@app.before_request
+def start_request_metrics():
+    if request.endpoint in (None, 'metrics'):
+        return
+    g.metrics_start = time.perf_counter()
+    IN_FLIGHT.inc(endpoint=request.endpoint)
+
+@app.after_request
+def count_request(response):
+    if 'metrics_start' in g:
+        REQUESTS.inc(endpoint=request.endpoint, status=response.status_code)
+        if response.status_code >= 500:
+            ERRORS.inc(endpoint=request.endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'metrics_start' in g:
+        IN_FLIGHT.dec(endpoint=request.endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start, endpoint=request.endpoint)
+
+def list_param(name):
+    """Values of `?name=a,b` (or a repeated form field) as a sorted list; empty when absent."""
+    values = request.values.getlist(name)
+    return sorted({item.strip() for value in values for item in value.split(',') if item.strip()})
+
+def filter_param():
+    """Filter expression from `name_key` (groups to keep) and `exclude_name_key` (groups to leave out)."""
+    return build_filter(list_param('name_key'), list_param('exclude_name_key'))
+
+def profile_mode():
+    """Returns the profiler requested with `X-Profile` / `?profile=`, or None."""
+    value = (request.headers.get('X-Profile') or request.values.get('profile') or '').strip().lower()
+    if value in ('', '0', 'false'):
+        return None
+    if value in ('1', 'true'):
+        return "cprofile"
+    if value not in PROFILE_MODES:
+        raise ValueError(f"'profile' must be one of {', '.join(PROFILE_MODES)}")
+    return value
+
+def search_unbatched(image_bytes, top_k_groups, hits_per_group, category, filter):
+    # Runs in the request thread so a profiler sees the whole search.
+    vector = extractor(io.BytesIO(image_bytes))
+    if vector is None:
+        return None
+    return milvus_manager.search_grouped([vector], top_k_groups=top_k_groups, hits_per_group=hits_per_group,
+                                         category=category, filter=filter)[0]
+
+def format_groups(groups, hits_per_group):
+    if hits_per_group > 1:
+        return groups
+    return [{key: value for key, value in group.items() if key != "hits"} for group in groups]
+
 @app.route('/api/search-by-image', methods=['POST'])
+@requires_ready
 def search_image():
 
     if 'image' not in request.files:
-        return jsonify({"status_code": 400, "message": "No file part", "data": null}), 400
+        return jsonify({"status_code": 400, "message": "No file part", "data": None}), 400
     
     file = request.files['image']
     if file.filename == '':
-        return jsonify({"status_code": 400, "message": "No selected file", "data": null}), 400
+        return jsonify({"status_code": 400, "message": "No selected file", "data": None}), 400
 
     try:
-        query_vector = extractor(file) 
-        
-        if not query_vector:
-            return jsonify({"status_code": 500, "message": "Extraction failed", "data": null}), 500
+        top_k_groups = int_param('top_k_groups', 10, 1, MAX_TOP_K_GROUPS)
+        hits_per_group = int_param('hits_per_group', 1, 1, MAX_HITS_PER_GROUP)
+        category = list_param('category')
+        filter = filter_param()
+        profile = profile_mode()
+    except ValueError as e:
+        return jsonify({"status_code": 400, "message": str(e), "data": None}), 400
 
-        search_results = milvus_manager.search_images(query_vector, limit=20)
+    if profile and not PROFILING_ENABLED:
+        return jsonify({"status_code": 403, "message": "Profiling is disabled (set PROFILING_ENABLED=1)", "data": None}), 403
+
+    try:
+        image_bytes = file.read()
+        if profile:
+            try:
+                groups, report = profile_call(profile, search_unbatched, image_bytes, top_k_groups, hits_per_group,
+                                              category, filter)
+            except ProfilerBusy as e:
+                return jsonify({"status_code": 409, "message": str(e), "data": None}), 409
+            if groups is None:
+                return jsonify({"status_code": 500, "message": "Extraction failed", "data": None, "profile": report}), 500
+            return jsonify({
+                "status_code": 200,
+                "message": "success",
+                "data": format_groups(groups, hits_per_group),
+                "profile": report,
+            })
+
+        cache_key = ResultCache.make_key(image_bytes, top_k_groups=top_k_groups, hits_per_group=hits_per_group,
+                                         category=",".join(category), filter=filter)
+        cached_results = result_cache.get(cache_key)
+        if cached_results is not None:
+            return jsonify({
+                "status_code": 200,
+                "message": "success",
+                "data": cached_results
+            })
+
+        groups = search_batcher.search(io.BytesIO(image_bytes), top_k_groups=top_k_groups,
+                                       hits_per_group=hits_per_group, category=category,
+                                       filter=filter)
         
-        final_results = []
-        seen_keys = set()
-
-        if search_results and len(search_results) > 0:            
-            for hit in search_results[0]:
-                entity = hit["entity"]
-                name_key = entity.get("name_key")
-                
-                if name_key and name_key not in seen_keys:
-                    seen_keys.add(name_key)
-                    final_results.append({
-                        "name_key": name_key,                        
-                        "score": round(float(hit["distance"]), 4)
-                    })
-                    
-                    if len(final_results) >= 10:
-                        break
+        if groups is None:
+            return jsonify({"status_code": 500, "message": "Extraction failed", "data": None}), 500
         
+        with STAGE_SECONDS.time(endpoint="search_image", stage="post_process"):
+            final_results = format_groups(groups, hits_per_group)
+            result_cache.put(cache_key, final_results)
+
         return jsonify({
             "status_code": 200,
             "message": "success",
@@ -72,60 +239,219 @@ def search_image():
 
     except Exception as e:
         print(f"❌ Error: {str(e)}")
-        return jsonify({"status_code": 500, "message": str(e), "data": null}), 500
+        return jsonify({"status_code": 500, "message": str(e), "data": None}), 500
+
+@app.route('/api/search-by-images', methods=['POST'])
+@requires_ready
+def search_images():
+    files = [file for file in request.files.getlist('images') if file.filename != '']
+    if not files:
+        return jsonify({"status_code": 400, "message": "No images provided", "data": None}), 400
+    if len(files) > MAX_IMAGES_PER_REQUEST:
+        return jsonify({"status_code": 400, "message": f"At most {MAX_IMAGES_PER_REQUEST} images per request", "data": None}), 400
+
+    try:
+        top_k_groups = int_param('top_k_groups', 10, 1, MAX_TOP_K_GROUPS)
+        hits_per_group = int_param('hits_per_group', 1, 1, MAX_HITS_PER_GROUP)
+        category = list_param('category')
+        filter = filter_param()
+        fusion = request.values.get('fusion', 'none').lower()
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"'fusion' must be one of {', '.join(FUSION_MODES)}")
+    except ValueError as e:
+        return jsonify({"status_code": 400, "message": str(e), "data": None}), 400
+
+    try:
+        vectors, failed = extractor.extract_batch([io.BytesIO(file.read()) for file in files], batch_size=len(files))
+        ok_indexes = [index for index in range(len(files)) if index not in failed]
+        if not ok_indexes:
+            return jsonify({"status_code": 500, "message": "Extraction failed", "data": None}), 500
+
+        if fusion == "mean":
+            groups = milvus_manager.search_grouped(
+                [mean_embedding(vectors)], top_k_groups=top_k_groups, hits_per_group=hits_per_group,
+                category=category,
+                filter=filter,
+            )[0]
+            data = format_groups(groups, hits_per_group)
+        elif fusion == "rrf":
+            grouped = milvus_manager.search_grouped(
+                vectors,
+                top_k_groups=min(top_k_groups * RRF_CANDIDATE_FACTOR, MAX_TOP_K_GROUPS),
+                hits_per_group=hits_per_group,
+                category=category,
+                filter=filter,
+            )
+            data = format_groups(reciprocal_rank_fusion(grouped, top_k_groups), hits_per_group)
+        else:
+            grouped = milvus_manager.search_grouped(
+                vectors, top_k_groups=top_k_groups, hits_per_group=hits_per_group, category=category,
+                filter=filter,
+            )
+            results = dict(zip(ok_indexes, grouped))
+            data = [{
+                "filename": file.filename,
+                "data": format_groups(results[index], hits_per_group) if index in results else None,
+                "error": failed.get(index),
+            } for index, file in enumerate(files)]
+
+        return jsonify({
+            "status_code": 200,
+            "message": "success",
+            "data": data,
+            "failed": [files[index].filename for index in failed],
+        })
+
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return jsonify({"status_code": 500, "message": str(e), "data": None}), 500
 
 @app.route('/api/search-by-image/add-image', methods=['POST'])
+@requires_ready
 def add_image():
     try:
         if 'image' not in request.files:
-            return jsonify({"status_code": 400, "message": "No image file provided", "data": null}), 400
+            return jsonify({"status_code": 400, "message": "No image file provided", "data": None}), 400
         
         name_key = request.form.get('name_key')
         if not name_key:
-            return jsonify({"status_code": 400, "message": "Missing name_key", "data": null}), 400
+            return jsonify({"status_code": 400, "message": "Missing name_key", "data": None}), 400
 
         file = request.files['image']
         if file.filename == '':
-            return jsonify({"status_code": 400, "message": "No selected file", "data": null}), 400
+            return jsonify({"status_code": 400, "message": "No selected file", "data": None}), 400
 
         if not os.path.exists(ADD_DIR):
             os.makedirs(ADD_DIR)
 
         target_name_key = name_key.strip() 
-        
-        if os.path.exists(DATA_DIR):
+        target_category = (request.form.get('category') or '').strip()
+        clean_filename = file.filename.replace(" ", "_") 
+        try:
+            check_catalog_name(target_name_key, "name_key")
+            check_catalog_name(clean_filename, "filename")
+            if target_category:
+                check_catalog_name(target_category, "category")
+        except ValueError as e:
+            return jsonify({"status_code": 400, "message": str(e), "data": None}), 400
+
+        if os.path.exists(DATA_DIR) and target_category:
             for existing_folder in os.listdir(DATA_DIR):
+                if existing_folder.lower().strip() == target_category.lower():
+                    target_category = existing_folder
+                    break
+
+        category_dir = os.path.join(DATA_DIR, target_category)
+        if os.path.exists(category_dir):
+            for existing_folder in os.listdir(category_dir):
                 if existing_folder.lower().strip() == target_name_key.lower():
                     print(f">>> Auto-corrected '{target_name_key}' -> '{existing_folder}'", flush=True)
                     target_name_key = existing_folder
                     break
         
-        temp_folder = os.path.join(ADD_DIR, target_name_key)
-        if not os.path.exists(temp_folder):
-            os.makedirs(temp_folder)
-
-        clean_filename = file.filename.replace(" ", "_") 
+        temp_folder = os.path.join(ADD_DIR, target_category, target_name_key)
         save_path = os.path.join(temp_folder, clean_filename)
-        
-        file.save(save_path)
-        
-        print(f">>> Received add request: {name_key} / {clean_filename}")
 
-        result = process_add_data(milvus_manager=milvus_manager, extractor=extractor)
+        # A run collecting or sweeping ADD_DIR waits until the file is saved and its job recorded.
+        with lock_uploads(shared=True):
+            if not os.path.exists(temp_folder):
+                os.makedirs(temp_folder)
+
+            with STAGE_SECONDS.time(endpoint="add_image", stage="save"):
+                file.save(save_path)
+
+            print(f">>> Received add request: {name_key} / {clean_filename}")
+
+            job_id = add_job_queue.submit(target_name_key, clean_filename, target_category)
 
         return jsonify({
-            "status_code": 200,
-            "message": "Image processed successfully",
-            "data": result,
-        })
+            "status_code": 202,
+            "message": "Image queued for processing",
+            "data": {"job_id": job_id},
+        }), 202
 
     except Exception as e:
         print(f"❌ Error adding image: {e}")
-        return jsonify({"status_code": 500, "message": str(e), "data": null}), 500
+        return jsonify({"status_code": 500, "message": str(e), "data": None}), 500
     
+@app.route('/api/search-by-image/jobs/<job_id>', methods=['GET'])
+@requires_ready
+def get_job(job_id):
+    job = add_job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status_code": 404, "message": "Job not found", "data": None}), 404
+
+    return jsonify({"status_code": 200, "message": "success", "data": job})
+
+@app.route('/api/search-by-image/import', methods=['GET'])
+@requires_ready
+def get_import_status():
+    return jsonify({"status_code": 200, "message": "success", "data": import_runner.latest()})
+
+@app.route('/api/search-by-image/import', methods=['POST'])
+@requires_ready
+def start_import():
+    reconcile = request.values.get('reconcile', '0').lower() in ('1', 'true')
+    record = import_runner.start(force=True, reason="manual", reconcile=reconcile)
+    if record is None:
+        return jsonify({"status_code": 409, "message": "An import is already running", "data": import_runner.latest()}), 409
+
+    return jsonify({"status_code": 202, "message": "Import started", "data": record}), 202
+
+def remove_catalog_entries(filename=None):
+    name_key = (request.values.get('name_key') or '').strip()
+    category = (request.values.get('category') or '').strip() or None
+    if not name_key:
+        return jsonify({"status_code": 400, "message": "Missing name_key", "data": None}), 400
+
+    lock_file = lock_manifest()
+    if lock_file is None:
+        return jsonify({"status_code": 409, "message": "An import is running, try again later", "data": None}), 409
+    try:
+        with lock_file:
+            result = remove_from_catalog(milvus_manager, name_key, filename, category)
+    except ValueError as e:
+        return jsonify({"status_code": 400, "message": str(e), "data": None}), 400
+    except Exception as e:
+        print(f"❌ Error deleting '{name_key}': {e}")
+        return jsonify({"status_code": 500, "message": str(e), "data": None}), 500
+
+    result_cache.invalidate()
+    return jsonify({"status_code": 200, "message": "success", "data": result})
+
+@app.route('/api/search-by-image/groups', methods=['DELETE'])
+@requires_ready
+def delete_group():
+    return remove_catalog_entries()
+
+@app.route('/api/search-by-image/images', methods=['DELETE'])
+@requires_ready
+def delete_image():
+    filename = (request.values.get('filename') or '').strip()
+    if not filename:
+        return jsonify({"status_code": 400, "message": "Missing filename", "data": None}), 400
+    return remove_catalog_entries(filename)
+
+@app.route('/api/search-by-image/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify({"status_code": 200, "message": "success", "data": result_cache.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/api/check-healthy', methods=['GET'])
+@app.route('/api/health/live', methods=['GET'])
 def check_healthy():
-    return jsonify({"status_code": 200, "message": "Server is healthy"})
+    if startup.phase == "failed":
+        return jsonify({"status_code": 500, "message": f"Startup failed: {startup.error}", "data": startup.status()}), 500
+    return jsonify({"status_code": 200, "message": "Server is healthy", "data": startup.status()})
+
+@app.route('/api/health/ready', methods=['GET'])
+def check_ready():
+    if not startup.ready:
+        return jsonify({"status_code": 503, "message": f"Service is starting ({startup.phase})", "data": startup.status()}), 503
+    return jsonify({"status_code": 200, "message": "Service is ready", "data": startup.status()})
 
 if __name__ == '__main__':
     print(f">>> Service running on port {PORT}", flush=True)
@@ -0,0 +1,270 @@
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from collections import defaultdict
+from dotenv import load_dotenv
+from extractor import (FeatureExtractor, MODEL_NAME, EXTRACTOR_BACKEND, SUPPORTED_BACKENDS,
+                       PREPROCESS_BACKEND, SUPPORTED_PREPROCESSORS)
+from milvus_db import MilvusManager, INDEX_TYPE, INDEX_PARAMS, SEARCH_PARAMS, SUPPORTED_INDEX_TYPES
+from manifest import ImportManifest
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_DIR
+from import_data import run_import, BATCH_SIZE
+from dedup import NEAR_DUPLICATE_THRESHOLD
+
+load_dotenv()
+
+BENCHMARK_CSV = os.getenv('BENCHMARK_CSV', 'utils/reverse_image_search.csv')
+BENCHMARK_ROOT = os.getenv('BENCHMARK_ROOT', '.')
+RECALL_AT = (1, 5, 10)
+
+def load_samples(csv_path, root):
+    """Reads (id, path, label) rows into import tasks, skipping images that are not on disk."""
+    tasks, missing = [], 0
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            rel_path = os.path.normpath(row['path'])
+            path = os.path.join(root, rel_path)
+            if not os.path.isfile(path):
+                missing += 1
+                continue
+            tasks.append({
+                "path": path,
+                "rel_path": rel_path,
+                "name_key": row['label'],
+                "filename": os.path.basename(rel_path),
+            })
+
+    if missing:
+        print(f"⚠️ {missing} images listed in '{csv_path}' were not found under '{root}'.", flush=True)
+    return tasks
+
+def split_holdout(tasks, fraction, seed):
+    """Holds out `fraction` of every label (at least one image, never the only one) as queries."""
+    if fraction <= 0:
+        return tasks, tasks
+
+    by_label = defaultdict(list)
+    for task in tasks:
+        by_label[task['name_key']].append(task)
+
+    rng = random.Random(seed)
+    indexed, queries = [], []
+    for label in sorted(by_label):
+        group = by_label[label]
+        rng.shuffle(group)
+        count = min(max(1, round(len(group) * fraction)), len(group) - 1)
+        queries.extend(group[:count])
+        indexed.extend(group[count:])
+    return indexed, queries
+
+def drop_self(groups, task):
+    """Removes the query's own vector from grouped results and re-ranks the groups."""
+    kept = []
+    for group in groups:
+        hits = [hit for hit in group["hits"]
+                if not (group["name_key"] == task['name_key'] and hit["filename"] == task['filename'])]
+        if hits:
+            kept.append(dict(group, score=hits[0]["score"], hits=hits))
+    return sorted(kept, key=lambda group: group["score"], reverse=True)
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 2) if values else None
+
+def run_queries(extractor, milvus_manager, queries, leave_one_out):
+    top_k = max(RECALL_AT)
+    ranks = []
+    embed_times, search_times, total_times = [], [], []
+
+    for task in queries:
+        start = time.perf_counter()
+        vectors, failed = extractor.extract_batch([task['path']], batch_size=1)
+        embedded = time.perf_counter()
+        if failed:
+            print(f"Error processing {task['path']}: {failed[0]}", flush=True)
+            continue
+
+        if leave_one_out:
+            groups = milvus_manager.search_grouped(vectors[:1], top_k_groups=top_k + 1,
+                                                   hits_per_group=2)[0]
+            groups = drop_self(groups, task)[:top_k]
+        else:
+            groups = milvus_manager.search_grouped(vectors[:1], top_k_groups=top_k)[0]
+        done = time.perf_counter()
+
+        labels = [group["name_key"] for group in groups]
+        ranks.append((task['name_key'], labels.index(task['name_key']) if task['name_key'] in labels else None))
+        embed_times.append(embedded - start)
+        search_times.append(done - embedded)
+        total_times.append(done - start)
+
+    return ranks, embed_times, search_times, total_times
+
+def recall_report(ranks):
+    by_label = defaultdict(list)
+    for label, rank in ranks:
+        by_label[label].append(rank)
+
+    def recall(label_ranks, k):
+        return round(sum(rank is not None and rank < k for rank in label_ranks) / len(label_ranks), 4)
+
+    all_ranks = [rank for _, rank in ranks]
+    return {
+        "overall": {f"recall@{k}": recall(all_ranks, k) for k in RECALL_AT} if ranks else {},
+        "macro": {
+            f"recall@{k}": round(float(np.mean([recall(r, k) for r in by_label.values()])), 4) for k in RECALL_AT
+        } if ranks else {},
+        "by_label": {
+            label: dict({f"recall@{k}": recall(r, k) for k in RECALL_AT}, queries=len(r))
+            for label, r in sorted(by_label.items())
+        },
+    }
+
+def latency_report(seconds):
+    return {
+        "mean_ms": round(float(np.mean(seconds)) * 1000, 2) if seconds else None,
+        "p50_ms": percentile_ms(seconds, 50),
+        "p99_ms": percentile_ms(seconds, 99),
+    }
+
+def run_benchmark(csv_path=BENCHMARK_CSV, root=BENCHMARK_ROOT, holdout=0.2, seed=0, backend=EXTRACTOR_BACKEND,
+                  preprocess=PREPROCESS_BACKEND, index_type=INDEX_TYPE, index_params=INDEX_PARAMS,
+                  search_params=SEARCH_PARAMS, use_cache=False, work_dir=None,
+                  near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Indexes the labelled images in `csv_path` into a scratch collection
+    through `run_import`, then queries each held-out image (or, with
+    `holdout=0`, every image against the rest) and reports recall, latency
+    and throughput as a dict.
+    """
+    tasks = load_samples(csv_path, root)
+    if not tasks:
+        print(f"No images from '{csv_path}' found under '{root}'.", flush=True)
+        return None
+
+    indexed, queries = split_holdout(tasks, holdout, seed)
+    keep_work_dir = work_dir is not None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    try:
+        print(f">>> Benchmarking '{backend}' / {index_type}: {len(indexed)} indexed, {len(queries)} queries...", flush=True)
+        load_start = time.perf_counter()
+        extractor = FeatureExtractor(MODEL_NAME, backend=backend, preprocess=preprocess)
+        model_load_seconds = time.perf_counter() - load_start
+
+        milvus_manager = MilvusManager(
+            uri=os.path.join(work_dir, "benchmark.db"),
+            dimension=extractor.hidden_size,
+            collection_name="benchmark",
+            index_type=index_type,
+            index_params=index_params,
+            search_params=search_params,
+        )
+        cache = EmbeddingCache(dimension=extractor.hidden_size, backend=backend,
+                               preprocess_version=extractor.preprocess_version,
+                               cache_dir=EMBEDDING_CACHE_DIR if use_cache else os.path.join(work_dir, "embedding_cache"))
+        summary = run_import(
+            milvus_manager,
+            tasks=indexed,
+            manifest=ImportManifest(os.path.join(work_dir, "import_manifest.db")),
+            cache=cache,
+            extractor=extractor,
+            near_duplicate_threshold=near_duplicate_threshold,
+        )
+
+        index_start = time.perf_counter()
+        milvus_manager.rebuild_index()
+        index_build_seconds = time.perf_counter() - index_start
+
+        ranks, embed_times, search_times, total_times = run_queries(
+            extractor, milvus_manager, queries, leave_one_out=holdout <= 0
+        )
+    finally:
+        if not keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    inference = summary["stages"].get("inference", {})
+    return {
+        "config": {
+            "csv": csv_path,
+            "model": MODEL_NAME,
+            "backend": backend,
+            "preprocess": preprocess,
+            "preprocess_version": extractor.preprocess_version,
+            "index_type": index_type,
+            "index_params": index_params,
+            "search_params": search_params,
+            "batch_size": BATCH_SIZE,
+            "holdout": holdout,
+            "seed": seed,
+            "embedding_cache": use_cache,
+            "near_duplicate_threshold": near_duplicate_threshold,
+        },
+        "dataset": {"images": len(tasks), "indexed": len(indexed), "queries": len(queries), "labels": len({t['name_key'] for t in tasks}),
+                    "vectors": summary["inserted"], "near_duplicates": summary["duplicates"]},
+        "recall": recall_report(ranks),
+        "latency": {
+            "query": latency_report(total_times),
+            "embed": latency_report(embed_times),
+            "search": latency_report(search_times),
+        },
+        "throughput": {
+            "model_load_seconds": round(model_load_seconds, 3),
+            "import_seconds": summary["seconds"],
+            "index_build_seconds": round(index_build_seconds, 3),
+            "embedded": summary["embedded"],
+            "cached": summary["cached"],
+            "embeddings_per_second": round(summary["embedded"] / summary["seconds"], 2) if summary["embedded"] else None,
+            "inference_per_second": inference.get("per_second"),
+        },
+        "stages": summary["stages"],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall and latency on the labelled reverse image search set.")
+    parser.add_argument("--csv", default=BENCHMARK_CSV)
+    parser.add_argument("--root", default=BENCHMARK_ROOT, help="Directory the CSV paths are relative to")
+    parser.add_argument("--holdout", type=float, default=0.2,
+                        help="Fraction of each label used as queries; 0 queries every image leave-one-out")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default=EXTRACTOR_BACKEND, choices=SUPPORTED_BACKENDS)
+    parser.add_argument("--preprocess", default=PREPROCESS_BACKEND, choices=SUPPORTED_PREPROCESSORS)
+    parser.add_argument("--index-type", default=INDEX_TYPE, choices=SUPPORTED_INDEX_TYPES)
+    parser.add_argument("--index-params", default=None, help='JSON, e.g. {"M": 16, "efConstruction": 200}')
+    parser.add_argument("--search-params", default=None, help='JSON, e.g. {"ef": 128}')
+    parser.add_argument("--use-cache", action="store_true", help="Reuse the shared embedding cache")
+    parser.add_argument("--near-duplicate-threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD,
+                        help="Skip indexed images this similar to one already in their group (0 disables)")
+    parser.add_argument("--work-dir", default=None, help="Keep the scratch collection here instead of a temp dir")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        csv_path=args.csv,
+        root=args.root,
+        holdout=args.holdout,
+        seed=args.seed,
+        backend=args.backend,
+        preprocess=args.preprocess,
+        index_type=args.index_type.upper(),
+        index_params=INDEX_PARAMS if args.index_params is None else json.loads(args.index_params),
+        search_params=SEARCH_PARAMS if args.search_params is None else json.loads(args.search_params),
+        use_cache=args.use_cache,
+        work_dir=args.work_dir,
+        near_duplicate_threshold=args.near_duplicate_threshold,
+    )
+    if report is None:
+        raise SystemExit(1)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output, flush=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
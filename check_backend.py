@@ -0,0 +1,73 @@
+import argparse
+import random
+import time
+import numpy as np
+from dotenv import load_dotenv
+from extractor import FeatureExtractor, MODEL_NAME, SUPPORTED_BACKENDS
+from import_data import collect_tasks, DATA_DIR
+
+load_dotenv()
+
+def embed_timed(extractor, paths):
+    start = time.perf_counter()
+    vectors, failed = extractor.extract_batch(paths)
+    return vectors, failed, (time.perf_counter() - start) * 1000 / max(len(paths), 1)
+
+def neighbour_overlap(reference, candidate, k):
+    """Mean fraction of each sample's top-k neighbours (within the sample) that both backends agree on."""
+    k = min(k, len(reference) - 1)
+    if k < 1:
+        return 1.0
+
+    def top_k(vectors):
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, -np.inf)
+        return np.argsort(-similarity, axis=1)[:, :k]
+
+    ref_top, cand_top = top_k(reference), top_k(candidate)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]))
+
+def check_backend(backend, samples=200, data_dir=DATA_DIR, k=10, seed=0):
+    tasks = collect_tasks(data_dir)
+    if not tasks:
+        print(f"Folder '{data_dir}' is empty.", flush=True)
+        return None
+
+    random.Random(seed).shuffle(tasks)
+    paths = [task['path'] for task in tasks[:samples]]
+
+    print(f">>> Comparing '{backend}' with 'fp32' on {len(paths)} images from '{data_dir}'...", flush=True)
+    reference, ref_failed, ref_ms = embed_timed(FeatureExtractor(MODEL_NAME, backend="fp32"), paths)
+    candidate, cand_failed, cand_ms = embed_timed(FeatureExtractor(MODEL_NAME, backend=backend), paths)
+
+    if ref_failed != cand_failed:
+        print("⚠️ Backends failed on different images; comparing the common subset.", flush=True)
+    ok = [i for i in range(len(paths)) if i not in ref_failed and i not in cand_failed]
+    ref_rows = [i for i in range(len(paths)) if i not in ref_failed]
+    cand_rows = [i for i in range(len(paths)) if i not in cand_failed]
+    reference = reference[[ref_rows.index(i) for i in ok]]
+    candidate = candidate[[cand_rows.index(i) for i in ok]]
+
+    cosine = np.sum(reference * candidate, axis=1)
+    report = {
+        "backend": backend,
+        "samples": len(ok),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "cosine_p5": float(np.percentile(cosine, 5)),
+        f"neighbour_overlap@{k}": neighbour_overlap(reference, candidate, k),
+        "fp32_ms_per_image": round(ref_ms, 2),
+        f"{backend}_ms_per_image": round(cand_ms, 2),
+    }
+    for key, value in report.items():
+        print(f"   - {key}: {value}", flush=True)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how closely an extractor backend matches fp32.")
+    parser.add_argument("--backend", default="int8", choices=[b for b in SUPPORTED_BACKENDS if b != "fp32"])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    args = parser.parse_args()
+
+    check_backend(args.backend, args.samples, args.data_dir)
@@ -0,0 +1,160 @@
+import os
+import json
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from extractor import FEATURE_DIMENSION
+from milvus_db import MilvusManager, quote_list
+from manifest import ImportManifest, lock_manifest, wait_message
+
+load_dotenv()
+
+# Cosine similarity at or above which a new image is treated as a duplicate
+# of one already stored in the same name_key group. 0 disables the check.
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0))
+NEAR_DUPLICATE_CANDIDATES = 5
+
+def group_filter(milvus_manager, name_key: str, category: str = "") -> str:
+    """
+    Filter for one (category, name_key) group. Flat-layout rows are matched
+    with `category == ""` where category is a typed field; collections with
+    dynamic fields (where it may be missing) are narrowed by `in_group`.
+    """
+    expr = f"name_key in {quote_list([name_key])}"
+    if category or milvus_manager.typed_schema:
+        expr += f" and category in {quote_list([category])}"
+    return expr
+
+def in_group(row, category: str) -> bool:
+    return (row.get("category") or "") == category
+
+def find_near_duplicates(milvus_manager, tasks, vectors, threshold=NEAR_DUPLICATE_THRESHOLD) -> dict:
+    """
+    Checks each embedded task against the vectors already stored in its
+    (category, name_key) group and against the tasks before it in the same
+    batch. Returns `{index: {"name_key", "filename", "score"}}` naming, for
+    every duplicate, the image it duplicates. A task's own `old_ids` (the
+    vector it is replacing) never count as a match.
+    """
+    if threshold <= 0 or not len(tasks):
+        return {}
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    by_group = {}
+    for index, task in enumerate(tasks):
+        by_group.setdefault((task.get('category', ""), task['name_key']), []).append(index)
+
+    duplicates = {}
+    for (category, name_key), indexes in by_group.items():
+        results = milvus_manager.search_batch(
+            vectors[indexes],
+            limit=NEAR_DUPLICATE_CANDIDATES,
+            filter=group_filter(milvus_manager, name_key, category),
+            output_fields=("filename", "name_key", "category"),
+        )
+        kept = []
+        for index, hits in zip(indexes, results):
+            old_ids = set(tasks[index].get('old_ids', []))
+            hit = next((hit for hit in hits if hit["id"] not in old_ids and in_group(hit["entity"], category)), None)
+            if hit is not None and hit["distance"] >= threshold:
+                duplicates[index] = {
+                    "name_key": hit["entity"].get("name_key"),
+                    "filename": hit["entity"].get("filename"),
+                    "score": round(float(hit["distance"]), 4),
+                }
+                continue
+
+            # Vectors are L2-normalized, so the dot product is the cosine similarity.
+            scores = vectors[kept] @ vectors[index] if kept else np.empty(0)
+            if len(scores) and scores.max() >= threshold:
+                match = tasks[kept[int(scores.argmax())]]
+                duplicates[index] = {
+                    "name_key": match['name_key'],
+                    "filename": match['filename'],
+                    "score": round(float(scores.max()), 4),
+                }
+                continue
+            kept.append(index)
+
+    return duplicates
+
+def scan_duplicates(milvus_manager, threshold):
+    """
+    Finds near-duplicates already in the collection, one name_key group at a
+    time. Within a group the oldest vector of each cluster is kept. Returns
+    a list of `{"id", "name_key", "filename", "duplicate_of", "score"}`.
+    """
+    groups = sorted({(row.get("category") or "", row.get("name_key"))
+                     for row in milvus_manager.iter_rows(["name_key", "category"])})
+
+    duplicates = []
+    for category, name_key in groups:
+        rows = milvus_manager.client.query(
+            milvus_manager.collection_name,
+            filter=group_filter(milvus_manager, name_key, category),
+            output_fields=["vector", "name_key", "filename", "category"],
+        )
+        rows = sorted((row for row in rows if in_group(row, category)), key=lambda row: row["id"])
+        if len(rows) < 2:
+            continue
+
+        vectors = np.asarray([row["vector"] for row in rows], dtype=np.float32)
+        kept = []
+        for index, row in enumerate(rows):
+            scores = vectors[kept] @ vectors[index] if kept else np.empty(0)
+            if len(scores) and scores.max() >= threshold:
+                original = rows[kept[int(scores.argmax())]]
+                duplicates.append({
+                    "id": row["id"],
+                    "name_key": name_key,
+                    "filename": row.get("filename"),
+                    "duplicate_of": original.get("filename"),
+                    "score": round(float(scores.max()), 4),
+                })
+                continue
+            kept.append(index)
+
+    return duplicates
+
+def remove_duplicates(threshold=NEAR_DUPLICATE_THRESHOLD, dry_run=True, output=None):
+    """
+    Reports (and unless `dry_run`, deletes) near-duplicate vectors already
+    in the collection. Their files stay in DATA_DIR; the manifest records
+    them without vectors so later imports leave them out too.
+    """
+    if threshold <= 0:
+        print("⚠️ Set NEAR_DUPLICATE_THRESHOLD (or --threshold), e.g. 0.97.", flush=True)
+        return None
+
+    milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
+    duplicates = scan_duplicates(milvus_manager, threshold)
+    total = milvus_manager.count()
+    print(f">>> {len(duplicates)} of {total} vectors are near-duplicates at >= {threshold}.", flush=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(duplicates, f, indent=2, ensure_ascii=False)
+    if dry_run or not duplicates:
+        return duplicates
+
+    ids = {entry["id"] for entry in duplicates}
+    manifest = ImportManifest()
+    manifest.record([
+        (path, entry['size'], entry['mtime'], entry['sha1'], [i for i in entry['ids'] if i not in ids])
+        for path, entry in manifest.entries().items() if ids & set(entry['ids'])
+    ])
+    milvus_manager.delete_ids(sorted(ids))
+    print(f"✅ Removed {len(ids)} near-duplicate vectors.", flush=True)
+    return duplicates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate images within each name_key group.")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD or 0.97,
+                        help="Cosine similarity treated as a duplicate")
+    parser.add_argument("--apply", action="store_true", help="Delete the duplicates instead of only reporting them")
+    parser.add_argument("--output", default=None, help="Write the duplicate list to this JSON file")
+    args = parser.parse_args()
+
+    with lock_manifest(wait=True, on_wait=wait_message("the running import or add job")):
+        if remove_duplicates(args.threshold, dry_run=not args.apply, output=args.output) is None:
+            raise SystemExit(1)
@@ -0,0 +1,105 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from extractor import MODEL_NAME, FEATURE_DIMENSION, PREPROCESS_VERSION, EXTRACTOR_BACKEND
+
+load_dotenv()
+
+EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', './embedding_cache')
+CACHE_QUERY_CHUNK = 500
+
+class EmbeddingCache:
+    """
+    On-disk embeddings keyed by image content hash. Each (model, backend,
+    preprocessing version) combination gets its own append-only float32
+    matrix, read through a memory map, and a sqlite index mapping content
+    hash -> matrix row.
+    """
+
+    def __init__(self, dimension=FEATURE_DIMENSION, model_name=MODEL_NAME, backend=EXTRACTOR_BACKEND,
+                 preprocess_version=PREPROCESS_VERSION, cache_dir=EMBEDDING_CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        namespace = hashlib.sha1(f"{model_name}|{backend}|{preprocess_version}|{dimension}".encode()).hexdigest()[:16]
+
+        self.dimension = dimension
+        self.row_bytes = dimension * np.dtype(np.float32).itemsize
+        self.matrix_path = os.path.join(cache_dir, f"{namespace}.f32")
+        self.lock = threading.Lock()
+        self._map = None
+
+        open(self.matrix_path, 'ab').close()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, f"{namespace}.idx"), timeout=30,
+                                    check_same_thread=False, isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows (sha1 TEXT PRIMARY KEY, row INTEGER)")
+
+    def _matrix(self, min_rows):
+        if self._map is None or len(self._map) < min_rows:
+            rows = os.path.getsize(self.matrix_path) // self.row_bytes
+            self._map = np.memmap(self.matrix_path, dtype=np.float32, mode='r', shape=(rows, self.dimension))
+        return self._map
+
+    def get_many(self, hashes: list) -> dict:
+        """Returns {sha1: vector} for the hashes that are cached."""
+        hashes = list(set(hashes))
+        rows = []
+        with self.lock:
+            for start in range(0, len(hashes), CACHE_QUERY_CHUNK):
+                chunk = hashes[start:start + CACHE_QUERY_CHUNK]
+                rows += self.conn.execute(
+                    f"SELECT sha1, row FROM rows WHERE sha1 IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+
+            if not rows:
+                return {}
+            matrix = self._matrix(max(row for _, row in rows) + 1)
+            return {sha1: np.array(matrix[row]) for sha1, row in rows}
+
+    def put_many(self, hashes: list, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(hashes):
+            return
+
+        with self.lock:
+            # BEGIN IMMEDIATE serializes appends across processes sharing the cache.
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                with open(self.matrix_path, 'ab') as f:
+                    first_row = f.tell() // self.row_bytes
+                    f.seek(first_row * self.row_bytes)
+                    f.truncate()
+                    f.write(vectors.tobytes())
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO rows (sha1, row) VALUES (?, ?)",
+                    [(sha1, first_row + offset) for offset, sha1 in enumerate(hashes)],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+def embed_tasks(tasks: list, extractor, cache: EmbeddingCache, timings: dict = None):
+    """
+    Embeds tasks (dicts with 'path' and 'sha1'), serving cache hits without
+    touching the model. Returns `(ok_tasks, vectors, failed)` where `failed`
+    maps indexes into `tasks` to error messages. `timings` is passed on to
+    `extract_batch`.
+    """
+    found = cache.get_many([task['sha1'] for task in tasks])
+    misses = [index for index, task in enumerate(tasks) if task['sha1'] not in found]
+
+    vectors, failed_misses = extractor.extract_batch([tasks[index]['path'] for index in misses], timings=timings)
+    computed = [index for position, index in enumerate(misses) if position not in failed_misses]
+    cache.put_many([tasks[index]['sha1'] for index in computed], vectors)
+
+    by_index = dict(zip(computed, vectors))
+    for index, task in enumerate(tasks):
+        if task['sha1'] in found:
+            by_index[index] = found[task['sha1']]
+
+    ok_indexes = sorted(by_index)
+    failed = {misses[position]: error for position, error in failed_misses.items()}
+    ok_vectors = np.array([by_index[index] for index in ok_indexes], dtype=np.float32).reshape(-1, cache.dimension)
+    return [tasks[index] for index in ok_indexes], ok_vectors, failed
@@ -1,34 +1,221 @@
 import torch
 import os
+import time
+import importlib.util
+import numpy as np
 from PIL import Image
 from transformers import AutoImageProcessor, AutoModel
-from sklearn.preprocessing import normalize
 from dotenv import load_dotenv
 
 load_dotenv()
 
 MODEL_NAME = os.getenv('MODEL_NAME', 'facebook/dinov2-small')
 FEATURE_DIMENSION = int(os.getenv('FEATURE_DIMENSION', 384))
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', 16))
+# "hf" runs the model's AutoImageProcessor; "fast" decodes JPEGs at reduced
+# size (PIL draft mode), resizes and crops each image in PIL and normalizes
+# the whole batch at once in NumPy.
+SUPPORTED_PREPROCESSORS = ("hf", "fast")
+PREPROCESS_BACKEND = os.getenv('PREPROCESS_BACKEND', 'hf').lower()
+# Bump whenever preprocessing changes the pixels fed to the model, so cached embeddings are not reused.
+PREPROCESS_VERSIONS = {"hf": "hf-1", "fast": "fast-1"}
+PREPROCESS_VERSION = PREPROCESS_VERSIONS.get(PREPROCESS_BACKEND, PREPROCESS_BACKEND)
+
+SUPPORTED_BACKENDS = ("fp32", "int8", "onnx")
+EXTRACTOR_BACKEND = os.getenv('EXTRACTOR_BACKEND', 'fp32').lower()
+ONNX_DIR = os.getenv('ONNX_DIR', './onnx_models')
+
+def onnx_model_path(modelname=MODEL_NAME) -> str:
+    return os.path.join(ONNX_DIR, modelname.strip('/').replace('/', '__') + '.onnx')
 
 class FeatureExtractor:
-    def __init__(self, modelname=MODEL_NAME):
+    """
+    DINOv2 CLS-token embedder. `backend` selects how the forward pass runs:
+    "fp32" (eager torch), "int8" (torch dynamic quantization of the Linear
+    layers, CPU only) or "onnx" (an exported graph run by onnxruntime).
+    """
+
+    def __init__(self, modelname=MODEL_NAME, backend=EXTRACTOR_BACKEND, preprocess=PREPROCESS_BACKEND,
+                 start_session=True):
+        if backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"Unsupported extractor backend '{backend}', expected one of {SUPPORTED_BACKENDS}")
+        if preprocess not in SUPPORTED_PREPROCESSORS:
+            raise ValueError(f"Unsupported preprocessing '{preprocess}', expected one of {SUPPORTED_PREPROCESSORS}")
+
+        self.backend = backend
+        self.session = None
+        self.onnx_path = None
         self.processor = AutoImageProcessor.from_pretrained(modelname, use_fast=True)
+        self.fast_preprocess = preprocess == "fast"
+        self.preprocess_version = PREPROCESS_VERSIONS[preprocess]
+        if self.fast_preprocess:
+            self._setup_fast_preprocess()
         self.model = AutoModel.from_pretrained(modelname)
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model.to(self.device)
         self.model.eval()
+        self.hidden_size = self.model.config.hidden_size
+        self.device = "cuda" if torch.cuda.is_available() and backend == "fp32" else "cpu"
 
-    def __call__(self, image_input) -> list:
-        try:
-            input_image = Image.open(image_input).convert("RGB")
-            inputs = self.processor(images=input_image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        if backend == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend == "onnx":
+            self.onnx_path = self._export_onnx(modelname)
+            self.model = None
+            if start_session:
+                self.start_session()
+            return
+
+        self.model.to(self.device)
+
+    def _export_onnx(self, modelname):
+        # Only look onnxruntime up here: importing it before a fork already breaks the children.
+        if importlib.util.find_spec("onnxruntime") is None:
+            raise RuntimeError("EXTRACTOR_BACKEND=onnx requires the 'onnxruntime' package")
+
+        path = onnx_model_path(modelname)
+        if not os.path.exists(path):
+            print(f">>> Exporting {modelname} to ONNX at {path}...", flush=True)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            size = self.processor.crop_size
+            dummy = torch.zeros(1, 3, size["height"], size["width"])
+            # Per-process temp name: workers or check_backend.py may export concurrently.
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                torch.onnx.export(
+                    self.model, (dummy,), tmp_path,
+                    input_names=["pixel_values"],
+                    output_names=["last_hidden_state"],
+                    dynamic_axes={"pixel_values": {0: "batch"}, "last_hidden_state": {0: "batch"}},
+                    opset_version=17,
+                    dynamo=False,
+                )
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return path
+
+    def start_session(self):
+        """
+        Creates the onnxruntime session for the "onnx" backend (a no-op for
+        the others). onnxruntime is not fork-safe, so a model preloaded in
+        the gunicorn master is built with `start_session=False` and each
+        worker calls this after fork.
+        """
+        if self.backend == "onnx" and self.session is None:
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(self.onnx_path, providers=["CPUExecutionProvider"])
+
+    def _setup_fast_preprocess(self):
+        processor = self.processor
+        if "shortest_edge" not in processor.size or not processor.size["shortest_edge"]:
+            raise ValueError("PREPROCESS_BACKEND=fast needs an image processor that resizes the shortest edge")
+
+        self.resize_edge = processor.size["shortest_edge"]
+        self.crop = (processor.crop_size["height"], processor.crop_size["width"]) if processor.do_center_crop else None
+        self.resample = Image.Resampling(processor.resample)
+        # (x * rescale - mean) / std folded into one multiply-add per pixel.
+        std = np.asarray(processor.image_std, dtype=np.float32)
+        self.pixel_scale = (processor.rescale_factor / std).reshape(1, 1, 1, 3)
+        self.pixel_offset = (-np.asarray(processor.image_mean, dtype=np.float32) / std).reshape(1, 1, 1, 3)
+
+    def _fit(self, image: Image.Image) -> np.ndarray:
+        """Resizes the shortest edge to `resize_edge` and center-crops, returning HWC uint8."""
+        width, height = image.size
+        scale = self.resize_edge / min(width, height)
+        size = (self.resize_edge, int(self.resize_edge * height / width)) if width <= height \
+            else (int(self.resize_edge * width / height), self.resize_edge)
+
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if scale != 1:
+            image = image.resize(size, self.resample)
 
+        if self.crop:
+            crop_height, crop_width = self.crop
+            left = (image.width - crop_width) // 2
+            top = (image.height - crop_height) // 2
+            image = image.crop((left, top, left + crop_width, top + crop_height))
+        return np.asarray(image, dtype=np.uint8)
+
+    def load_image(self, image_input):
+        image = Image.open(image_input)
+        if not self.fast_preprocess:
+            return image.convert("RGB")
+
+        if image.format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying above the resize target.
+            scale = self.resize_edge / min(image.size)
+            image.draft("RGB", (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+        return self._fit(image)
+
+    def preprocess(self, images: list) -> torch.Tensor:
+        if not self.fast_preprocess:
+            return self.processor(images=images, return_tensors="pt")["pixel_values"]
+
+        batch = np.stack([image if isinstance(image, np.ndarray) else self._fit(image) for image in images])
+        pixel_values = batch.astype(np.float32) * self.pixel_scale + self.pixel_offset
+        return torch.from_numpy(np.ascontiguousarray(pixel_values.transpose(0, 3, 1, 2)))
+
+    def embed(self, pixel_values: torch.Tensor) -> np.ndarray:
+        if self.backend == "onnx":
+            if self.session is None:
+                raise RuntimeError("ONNX session not started, call start_session() first")
+            last_hidden_state = self.session.run(["last_hidden_state"], {"pixel_values": pixel_values.numpy()})[0]
+            feature_vectors = last_hidden_state[:, 0, :]
+        else:
             with torch.no_grad():
-                outputs = self.model(**inputs)
+                outputs = self.model(pixel_values=pixel_values.to(self.device))
+            feature_vectors = outputs.last_hidden_state[:, 0, :].cpu().numpy()
+
+        feature_vectors = np.asarray(feature_vectors, dtype=np.float32)
+        norms = np.linalg.norm(feature_vectors, axis=1, keepdims=True)
+        return feature_vectors / np.where(norms == 0, 1, norms)
 
-            feature_vector = outputs.last_hidden_state[:, 0, :].cpu().numpy()
-            return normalize(feature_vector, norm="l2").flatten().tolist()
+    def __call__(self, image_input) -> np.ndarray:
+        """Returns the (D,) float32 embedding of one image, or None if it could not be processed."""
+        try:
+            input_image = self.load_image(image_input)
+            return self.embed(self.preprocess([input_image]))[0]
         except Exception as e:
             print(f"Error extracting features: {e}")
-            return []
\ No newline at end of file
+            return None
+
+    def extract_batch(self, paths_or_files: list, batch_size: int = INFERENCE_BATCH_SIZE, timings: dict = None):
+        """
+        Embed many images with one forward pass per `batch_size` chunk.
+
+        Returns `(vectors, failed)`: `vectors` is an (N, D) float32 array of
+        L2-normalized CLS embeddings for the inputs that decoded, in input
+        order; `failed` maps the index of every input that could not be
+        decoded to its error message. If `timings` is given, seconds spent in
+        "decode", "preprocess" and "inference" are added to it.
+        """
+        vectors = []
+        failed = {}
+        timings = {} if timings is None else timings
+
+        def record(stage, start):
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+        for start in range(0, len(paths_or_files), batch_size):
+            images = []
+            stage_start = time.perf_counter()
+            for index, image_input in enumerate(paths_or_files[start:start + batch_size], start):
+                try:
+                    images.append(self.load_image(image_input))
+                except Exception as e:
+                    failed[index] = str(e)
+            record("decode", stage_start)
+
+            if images:
+                stage_start = time.perf_counter()
+                pixel_values = self.preprocess(images)
+                record("preprocess", stage_start)
+
+                stage_start = time.perf_counter()
+                vectors.append(self.embed(pixel_values))
+                record("inference", stage_start)
+
+        if not vectors:
+            return np.empty((0, self.hidden_size), dtype=np.float32), failed
+        return np.concatenate(vectors), failed
@@ -0,0 +1,37 @@
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RRF_K = int(os.getenv('RRF_K', 60))
+FUSION_MODES = ("none", "mean", "rrf")
+
+def mean_embedding(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalized mean of several normalized query embeddings."""
+    mean = vectors.mean(axis=0)
+    norm = np.linalg.norm(mean)
+    return (mean / norm if norm else mean).astype(np.float32)
+
+def reciprocal_rank_fusion(grouped_lists: list, top_k_groups: int, k: int = RRF_K) -> list:
+    """
+    Fuses per-query name_key group rankings: each group scores sum(1 / (k + rank))
+    over the queries that returned it. Keeps each group's best similarity and hits.
+    """
+    fused = {}
+    for groups in grouped_lists:
+        for rank, group in enumerate(groups, 1):
+            entry = fused.setdefault(group["name_key"], {
+                "name_key": group["name_key"],
+                "rrf_score": 0.0,
+                "score": group["score"],
+                "hits": group["hits"],
+            })
+            entry["rrf_score"] += 1.0 / (k + rank)
+            if group["score"] > entry["score"]:
+                entry["score"], entry["hits"] = group["score"], group["hits"]
+
+    ranked = sorted(fused.values(), key=lambda entry: entry["rrf_score"], reverse=True)[:top_k_groups]
+    for entry in ranked:
+        entry["rrf_score"] = round(entry["rrf_score"], 6)
+    return ranked
@@ -0,0 +1,54 @@
+import gc
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = 120
+bind = f"0.0.0.0:{os.getenv('PORT', 51200)}"
+
+# Import app.py in the master. With several workers DINOv2 is loaded there
+# too so forked workers share its weights copy-on-write; with one worker it
+# loads in the background after bind. Milvus clients and background threads
+# do not survive fork, so app.py starts them per worker in post_fork.
+preload_app = True
+os.environ['DEFER_WORKER_INIT'] = '1'
+os.environ.setdefault('PRELOAD_MODEL', '1' if workers > 1 else '0')
+# Workers share their metrics through snapshot files so /metrics covers all of them.
+os.environ.setdefault('METRICS_DIR', './metrics')
+
+broker = None
+
+def on_starting(server):
+    # Serve Milvus through a broker process so several workers and the CLI tools can share it.
+    global broker
+    db_path = os.getenv('MILVUS_DB_PATH', './milvus.db')
+    if os.getenv('MILVUS_URI') or not db_path.endswith('.db'):
+        return
+
+    from vector_store import read_broker_uri, start_broker
+    uri = read_broker_uri()
+    if uri:
+        server.log.info("Using running vector-store broker at %s", uri)
+    else:
+        broker, uri = start_broker(db_path)
+        server.log.info("Vector-store broker pid %s serving %s at %s", broker.pid, db_path, uri)
+    os.environ['MILVUS_URI'] = uri
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+def post_fork(server, worker):
+    import torch
+    torch_threads = int(os.getenv('TORCH_THREADS', 0)) or max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(torch_threads)
+
+    import app
+    app.init_worker()
+    server.log.info("Worker %s starting with %s torch threads", worker.pid, torch_threads)
+
+def on_exit(server):
+    if broker is not None:
+        broker.terminate()
@@ -1,71 +1,321 @@
 import os
+import time
+import argparse
+import numpy as np
 from tqdm import tqdm
 from dotenv import load_dotenv
 from extractor import FeatureExtractor, FEATURE_DIMENSION, MODEL_NAME
 from milvus_db import MilvusManager
+from manifest import ImportManifest, file_hash, lock_manifest, wait_message
+from pipeline import ImportPipeline
+from embedding_cache import EmbeddingCache
+from dedup import find_near_duplicates, NEAR_DUPLICATE_THRESHOLD
 
 load_dotenv()
 
 DATA_DIR = os.getenv('DATA_DIR', 'product_train')
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', 50))
 
-def run_import(milvus_manager=None):
-    print("\n" + "="*40, flush=True)
-    print("🚀 STARTING AUTO IMPORT DATA...", flush=True)
-    print("="*40, flush=True)
-
-    if milvus_manager is None:
-        milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
+def folder_category(rel_dir: str) -> str:
+    """
+    Catalog category of a folder relative to DATA_DIR: the top-level folder
+    in a `category/name_key/` layout, empty for the flat `name_key/` layout.
+    """
+    parts = os.path.normpath(rel_dir).split(os.sep)
+    return parts[0] if len(parts) >= 2 else ""
 
-    extractor = FeatureExtractor(MODEL_NAME)
-    valid_tasks = []
+def collect_tasks(data_dir=DATA_DIR):
+    tasks = []
 
-    for root, dirs, files in os.walk(DATA_DIR):
+    for root, dirs, files in os.walk(data_dir):
         current_folder_name = os.path.basename(root)
         
-        if root == DATA_DIR or current_folder_name.startswith('.'):
+        if root == data_dir or current_folder_name.startswith('.'):
             continue
 
+        category = folder_category(os.path.relpath(root, data_dir))
         for file in files:
             if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-                valid_tasks.append({
-                    "path": os.path.join(root, file),
+                path = os.path.join(root, file)
+                tasks.append({
+                    "path": path,
+                    "rel_path": os.path.relpath(path, data_dir),
                     "name_key": current_folder_name,
-                    "filename": file
+                    "filename": file,
+                    "category": category,
                 })
 
-    if not valid_tasks:
-        print(f"Folder '{DATA_DIR}' is empty.", flush=True)
-        return
+    return tasks
+
+def match_existing_vectors(milvus_manager, tasks) -> list:
+    """Manifest entries for the `tasks` that already have vectors under their (name_key, filename)."""
+    ids_by_key = {}
+    for row in milvus_manager.iter_rows(["name_key", "filename"]):
+        ids_by_key.setdefault((row.get("name_key"), row.get("filename")), []).append(row["id"])
+
+    entries = []
+    for task in tqdm(tasks, desc="Adopting"):
+        ids = ids_by_key.get((task['name_key'], task['filename']))
+        if ids:
+            stat = os.stat(task['path'])
+            entries.append((task['rel_path'], stat.st_size, stat.st_mtime, file_hash(task['path']), ids))
+    return entries
+
+def adopt_existing_vectors(milvus_manager, manifest, tasks):
+    """Seeds an empty manifest from a collection that was imported before manifests existed."""
+    entries = match_existing_vectors(milvus_manager, tasks)
+    manifest.record(entries)
+    print(f">>> Manifest seeded with {len(entries)} already-embedded files.", flush=True)
+
+def plan_import(tasks, known):
+    """
+    Splits `tasks` against the manifest entries in `known`. Returns the tasks
+    that need embedding (new or changed content), manifest entries to refresh
+    for files that were only touched, and the relative paths that are gone.
+    """
+    to_embed = []
+    touched = []
+
+    for task in tasks:
+        stat = os.stat(task['path'])
+        entry = known.get(task['rel_path'])
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            continue
+
+        sha1 = file_hash(task['path'])
+        if entry and entry['sha1'] == sha1:
+            touched.append((task['rel_path'], stat.st_size, stat.st_mtime, sha1, entry['ids']))
+            continue
+
+        to_embed.append(dict(task, size=stat.st_size, mtime=stat.st_mtime, sha1=sha1,
+                             old_ids=entry['ids'] if entry else []))
+
+    current = {task['rel_path'] for task in tasks}
+    removed = [rel_path for rel_path in known if rel_path not in current]
+    return to_embed, touched, removed
+
+def requeue_duplicates(tasks, known) -> list:
+    """
+    Files skipped as near-duplicates have manifest entries without vectors.
+    Once a file disappears from their folder they may have been duplicating
+    it, so their paths are returned to be planned again.
+    """
+    current = {task['rel_path'] for task in tasks}
+    emptied = {os.path.dirname(path) for path in known if path not in current}
+    return [path for path, entry in known.items()
+            if not entry['ids'] and path in current and os.path.dirname(path) in emptied]
+
+def run_import(milvus_manager=None, data_dir=DATA_DIR, tasks=None, manifest=None, cache=None, extractor=None,
+               progress_callback=None, near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Brings the collection in line with `data_dir` (or an explicit `tasks`
+    list shaped like `collect_tasks()` output). Returns a summary dict with
+    file counts, the pipeline stage stats and the wall time in seconds.
+    `progress_callback(done, total)` is called after every stored batch,
+    counting the files that needed embedding. Images at least
+    `near_duplicate_threshold` similar to one already in their group are
+    recorded in the manifest but not inserted.
+    """
+    print("\n" + "="*40, flush=True)
+    print("🚀 STARTING AUTO IMPORT DATA...", flush=True)
+    print("="*40, flush=True)
+
+    started = time.perf_counter()
+    if milvus_manager is None:
+        milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
+    if manifest is None:
+        manifest = ImportManifest()
+
+    manifest.set_complete(False)
+    valid_tasks = collect_tasks(data_dir) if tasks is None else tasks
+    summary = {"files": len(valid_tasks), "embedded": 0, "cached": 0, "removed": 0, "inserted": 0,
+               "duplicates": 0, "stages": {}}
+
+    def finish():
+        manifest.set_complete(True)
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        print(f"Import finished. Total: {summary['inserted']}"
+              + (f" ({summary['duplicates']} near-duplicates skipped)" if summary['duplicates'] else ""), flush=True)
+        return summary
+
+    if not milvus_manager.has_data():
+        manifest.clear()
+    elif not manifest.entries():
+        adopt_existing_vectors(milvus_manager, manifest, valid_tasks)
+
+    requeued = requeue_duplicates(valid_tasks, manifest.entries())
+    if requeued:
+        manifest.remove(requeued)
+        print(f">>> Re-checking {len(requeued)} near-duplicates whose folder lost files.", flush=True)
+
+    known = manifest.entries()
+    to_embed, touched, removed = plan_import(valid_tasks, known)
+    manifest.record(touched)
+
+    if removed:
+        milvus_manager.delete_ids([i for rel_path in removed for i in known[rel_path]['ids']])
+        manifest.remove(removed)
+        summary["removed"] = len(removed)
+        print(f">>> Removed vectors for {len(removed)} deleted files.", flush=True)
+
+    if not to_embed:
+        print(f"Nothing new to import in '{data_dir}'.", flush=True)
+        return finish()
+
+    print(f">>> {len(to_embed)} new or changed files, {len(valid_tasks) - len(to_embed)} unchanged.", flush=True)
+    if cache is None:
+        cache = EmbeddingCache()
+    cached = cache.get_many([task['sha1'] for task in to_embed])
+    total = len(to_embed)
+    done = 0
+
+    def report_progress(count):
+        nonlocal done
+        done += count
+        if progress_callback:
+            progress_callback(done, total)
 
-    batch_data = []
-    total_inserted = 0
+    def store(ok_tasks, vectors):
+        duplicates = find_near_duplicates(milvus_manager, ok_tasks, vectors, near_duplicate_threshold)
+        for index, original in duplicates.items():
+            print(f"   ~ {ok_tasks[index]['rel_path']} duplicates {original['filename']} ({original['score']})", flush=True)
+        keep = [index for index in range(len(ok_tasks)) if index not in duplicates]
+        new_tasks = [ok_tasks[index] for index in keep]
 
-    for task in tqdm(valid_tasks, desc="Processing"):
-        try:
-            vector = extractor(task['path'])
-            if not vector:
-                continue
+        res = milvus_manager.insert_batch({
+            "vector": np.asarray(vectors, dtype=np.float32)[keep],
+            "name_key": [task['name_key'] for task in new_tasks],
+            "filename": [task['filename'] for task in new_tasks],
+            "category": [task.get('category', "") for task in new_tasks],
+            "content_hash": [task['sha1'] for task in new_tasks],
+        })
+        ids = res["ids"] if res else []
+        milvus_manager.delete_ids([i for task in ok_tasks for i in task['old_ids']])
+        manifest.record([
+            (task['rel_path'], task['size'], task['mtime'], task['sha1'], [new_id])
+            for task, new_id in zip(new_tasks, ids)
+        ] + [
+            (ok_tasks[index]['rel_path'], ok_tasks[index]['size'], ok_tasks[index]['mtime'], ok_tasks[index]['sha1'], [])
+            for index in duplicates
+        ])
+        summary["inserted"] += len(new_tasks)
+        summary["duplicates"] += len(duplicates)
 
-            batch_data.append({
-                "vector": vector,
-                "name_key": task['name_key'],
-                "filename": task['filename']
-            })
+    cached_tasks = [task for task in to_embed if task['sha1'] in cached]
+    to_embed = [task for task in to_embed if task['sha1'] not in cached]
+    if cached_tasks:
+        print(f">>> {len(cached_tasks)} embeddings found in cache.", flush=True)
+        for start in range(0, len(cached_tasks), BATCH_SIZE):
+            batch_tasks = cached_tasks[start:start + BATCH_SIZE]
+            store(batch_tasks, np.stack([cached[task['sha1']] for task in batch_tasks]))
+            report_progress(len(batch_tasks))
+        summary["cached"] = len(cached_tasks)
 
-            if len(batch_data) >= BATCH_SIZE:
-                milvus_manager.insert_batch(batch_data)
-                total_inserted += len(batch_data)
-                batch_data = []
+    if not to_embed:
+        return finish()
 
-        except Exception as e:
-            print(f"Error processing {task['path']}: {e}", flush=True)
+    if extractor is None:
+        extractor = FeatureExtractor(MODEL_NAME)
+    pipeline = ImportPipeline(extractor, BATCH_SIZE)
 
-    if batch_data:
-        milvus_manager.insert_batch(batch_data)
-        total_inserted += len(batch_data)
+    with tqdm(total=len(to_embed), desc="Processing") as pbar:
+        def insert_vectors(batch_tasks, ok_tasks, vectors, failed):
+            pbar.update(len(batch_tasks))
+            for index, error in failed.items():
+                print(f"Error processing {batch_tasks[index]['path']}: {error}", flush=True)
+            if ok_tasks:
+                cache.put_many([task['sha1'] for task in ok_tasks], vectors)
+                store(ok_tasks, vectors)
+            report_progress(len(batch_tasks))
 
-    print(f"Import finished. Total: {total_inserted}", flush=True)
+        pipeline.run(to_embed, insert_vectors)
+
+    for line in pipeline.report():
+        print(f"   - {line}", flush=True)
+    summary["embedded"] = pipeline.stats["inference"].items
+    summary["stages"] = {
+        name: {"items": stage.items, "seconds": round(stage.seconds, 3), "per_second": round(stage.rate(), 2)}
+        for name, stage in pipeline.stats.items()
+    }
+    return finish()
+
+def reconcile(milvus_manager=None, data_dir=DATA_DIR, manifest=None, dry_run=False, **import_kwargs):
+    """
+    Diffs the whole collection against `data_dir` and the manifest, deletes
+    the vectors nothing on disk accounts for (orphans, duplicates, vectors
+    whose content hash or category no longer matches their file), then lets
+    `run_import` insert what is missing. Returns a report of the planned
+    changes, plus the import summary under "import" unless `dry_run`.
+    """
+    if milvus_manager is None:
+        milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
+    if manifest is None:
+        manifest = ImportManifest()
+
+    tasks = collect_tasks(data_dir)
+    tasks_by_path = {task['rel_path']: task for task in tasks}
+    rows = {row['id']: row for row in milvus_manager.iter_rows(["category", "content_hash"])}
+
+    known = manifest.entries()
+    adopted = []
+    if rows and not known:
+        adopted = match_existing_vectors(milvus_manager, tasks)
+        known = {path: {"size": size, "mtime": mtime, "sha1": sha1, "ids": ids}
+                 for path, size, mtime, sha1, ids in adopted}
+
+    stale, duplicates, forget, trimmed = [], [], [], []
+    for rel_path, entry in known.items():
+        task = tasks_by_path.get(rel_path)
+        if task is None or not entry['ids']:
+            continue  # run_import deletes removed files; near-duplicates have no vector
+        live = [i for i in entry['ids'] if i in rows
+                and (rows[i].get('category') or "") == task['category']
+                and rows[i].get('content_hash') in (None, "", entry['sha1'])]
+        stale.extend(i for i in entry['ids'] if i in rows and i not in live)
+        if not live:
+            forget.append(rel_path)
+        elif len(live) > 1 or len(live) != len(entry['ids']):
+            duplicates.extend(live[:-1])
+            trimmed.append((rel_path, entry['size'], entry['mtime'], entry['sha1'], live[-1:]))
+
+    referenced = {i for entry in known.values() for i in entry['ids']}
+    orphans = [i for i in rows if i not in referenced]
+
+    planned = {path: entry for path, entry in known.items() if path not in forget}
+    planned.update({path: {"size": size, "mtime": mtime, "sha1": sha1, "ids": ids}
+                    for path, size, mtime, sha1, ids in trimmed})
+    to_embed, touched, removed = plan_import(tasks, planned)
+    report = {
+        "files": len(tasks),
+        "vectors": len(rows),
+        "orphans": len(orphans),
+        "stale": len(stale),
+        "duplicates": len(duplicates),
+        "removed": len(removed),
+        "to_embed": len(to_embed),
+        "dry_run": dry_run,
+    }
+    print(f">>> Reconcile: {report}", flush=True)
+    if dry_run:
+        return report
+
+    milvus_manager.delete_ids(orphans + stale + duplicates)
+    manifest.record(adopted)
+    manifest.remove(forget)
+    manifest.record(trimmed)
+    report["import"] = run_import(milvus_manager, data_dir, tasks=tasks, manifest=manifest, **import_kwargs)
+    return report
 
 if __name__ == "__main__":
-    run_import()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Import DATA_DIR into Milvus, skipping files already embedded.")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Also delete vectors no file on disk accounts for (orphans, duplicates, stale content)")
+    parser.add_argument("--dry-run", action="store_true", help="With --reconcile, only report what would change")
+    args = parser.parse_args()
+
+    # Imports from the API and add-image runs take the same lock.
+    with lock_manifest(wait=True, on_wait=wait_message("the running import or add job")):
+        if args.reconcile:
+            reconcile(dry_run=args.dry_run)
+        else:
+            run_import()
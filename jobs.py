@@ -0,0 +1,257 @@
+import os
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+from add_data import process_add_data, lock_add_dir
+from import_data import run_import, reconcile
+from manifest import ImportManifest, lock_manifest
+
+load_dotenv()
+
+MAX_JOB_HISTORY = int(os.getenv('MAX_JOB_HISTORY', 1000))
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', './jobs.db')
+
+class AddJobQueue:
+    """
+    Background ingestion for uploaded images. `submit()` records a job and
+    returns its id immediately; a worker thread drains every queued job in
+    one `process_add_data` run, so a burst of uploads costs one pass over
+    ADD_DIR and a handful of `insert_batch` calls. `on_complete` is called
+    after every run, e.g. to drop cached search results.
+
+    Job records live in a sqlite file and runs hold an exclusive lock on
+    ADD_DIR, so several server processes can share one queue: any of them
+    can report on a job, and only one walks ADD_DIR at a time. Uploads are
+    saved and recorded under `lock_uploads`, so the run that collects a
+    file also claims its job, whichever process queued it. Runs also wait
+    for the import lock: an import that collected DATA_DIR before a run
+    moved files into it would otherwise delete their fresh vectors as
+    removed or orphaned.
+    """
+
+    def __init__(self, milvus_manager, extractor, on_complete=None, db_path=JOBS_DB_PATH):
+        self.milvus_manager = milvus_manager
+        self.extractor = extractor
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, finished_at REAL, data TEXT)")
+
+        self.worker = threading.Thread(target=self._run, name="add-image-jobs", daemon=True)
+        self.worker.start()
+
+    def submit(self, name_key: str, filename: str, category: str = "") -> str:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "category": category,
+            "name_key": name_key,
+            "filename": filename,
+            "progress": {"done": 0, "total": 0},
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO jobs (job_id, finished_at, data) VALUES (?, NULL, ?)",
+                              (job_id, json.dumps(job)))
+            self._prune()
+        self.pending.put(job_id)
+        return job_id
+
+    def get(self, job_id: str):
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _prune(self):
+        self.conn.execute(
+            "DELETE FROM jobs WHERE job_id IN ("
+            "SELECT job_id FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at "
+            "LIMIT MAX(0, (SELECT COUNT(*) FROM jobs) - ?))",
+            (MAX_JOB_HISTORY,),
+        )
+
+    def _drain(self):
+        job_ids = [self.pending.get()]
+        while True:
+            try:
+                job_ids.append(self.pending.get_nowait())
+            except queue.Empty:
+                return job_ids
+
+    def _claim(self):
+        """Marks every unfinished job, from any process, as running and returns their ids."""
+        with self.lock:
+            rows = self.conn.execute("SELECT job_id FROM jobs WHERE finished_at IS NULL").fetchall()
+        job_ids = [job_id for (job_id,) in rows]
+        self._update(job_ids, status="running")
+        return job_ids
+
+    def _update(self, job_ids, **fields):
+        with self.lock, self.conn:
+            for job_id in job_ids:
+                row = self.conn.execute("SELECT data FROM jobs WHERE job_id = ? AND finished_at IS NULL",
+                                        (job_id,)).fetchone()
+                if row is None:
+                    continue
+                job = dict(json.loads(row[0]), **fields)
+                self.conn.execute("UPDATE jobs SET finished_at = ?, data = ? WHERE job_id = ?",
+                                  (job["finished_at"], json.dumps(job), job_id))
+
+    def _run(self):
+        while True:
+            # Only a wake-up: the run reports to the jobs it claims once ADD_DIR is collected.
+            job_ids = self._drain()
+
+            def on_progress(done, total):
+                self._update(job_ids, progress={"done": done, "total": total})
+
+            def on_collected(tasks):
+                job_ids[:] = self._claim()
+
+            try:
+                with lock_add_dir(), \
+                        lock_manifest(wait=True, on_wait=lambda: self._update(job_ids, status="waiting_for_import")):
+                    self._update(job_ids, status="running")
+                    result = process_add_data(
+                        milvus_manager=self.milvus_manager,
+                        extractor=self.extractor,
+                        progress_callback=on_progress,
+                        on_collected=on_collected,
+                    )
+                self._update(job_ids, status="done", result=result, finished_at=time.time())
+            except Exception as e:
+                print(f"❌ Error in add-image job: {e}", flush=True)
+                self._update(job_ids, status="error", error=str(e), finished_at=time.time())
+            finally:
+                if self.on_complete:
+                    self.on_complete()
+
+class ImportRunner:
+    """
+    Runs `run_import` on a background thread so a worker serves searches
+    (against the partially filled collection) while the catalog is embedded.
+    Progress is kept in the same sqlite file as the add-image jobs, so every
+    server process reports the same import; a lock next to the manifest
+    makes sure only one of them runs it.
+    """
+
+    def __init__(self, milvus_manager, extractor, on_complete=None, db_path=JOBS_DB_PATH):
+        self.milvus_manager = milvus_manager
+        self.extractor = extractor
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+        self.thread = None
+
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS imports (import_id TEXT PRIMARY KEY, started_at REAL, data TEXT)")
+
+    def start(self, force: bool = False, reason: str = "manual", reconcile: bool = False):
+        """
+        Starts an import and returns its record, or None if one is already
+        running here or in another process. Without `force` nothing runs
+        when the collection has data and the last import completed. With
+        `reconcile` the import first sweeps out vectors no file accounts for.
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return None
+            lock_file = lock_manifest()
+            if lock_file is None:
+                return None
+            self._mark_interrupted()
+
+            try:
+                if not force and self.milvus_manager.has_data() and ImportManifest().is_complete():
+                    print(">>> DB Check: DATA EXISTS. Skipping Import.", flush=True)
+                    lock_file.close()
+                    return None
+            except Exception:
+                lock_file.close()
+                raise
+
+            record = {
+                "import_id": uuid.uuid4().hex,
+                "status": "running",
+                "reason": reason,
+                "reconcile": reconcile,
+                "progress": {"done": 0, "total": 0, "rate": None, "eta_seconds": None},
+                "result": None,
+                "error": None,
+                "started_at": time.time(),
+                "finished_at": None,
+            }
+            self._save(record)
+            self.thread = threading.Thread(target=self._run, args=(record, lock_file), name="import", daemon=True)
+            self.thread.start()
+            return record
+
+    def latest(self):
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM imports ORDER BY started_at DESC LIMIT 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _mark_interrupted(self):
+        # Holding the manifest lock means no process is importing, so any
+        # "running" record belongs to a process that died mid-import.
+        rows = self.conn.execute("SELECT data FROM imports").fetchall()
+        for (data,) in rows:
+            record = json.loads(data)
+            if record["status"] == "running":
+                record.update(status="interrupted", finished_at=time.time())
+                self._save(record)
+
+    def _save(self, record):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO imports (import_id, started_at, data) VALUES (?, ?, ?)",
+                              (record["import_id"], record["started_at"], json.dumps(record)))
+            self.conn.execute(
+                "DELETE FROM imports WHERE import_id NOT IN ("
+                "SELECT import_id FROM imports ORDER BY started_at DESC LIMIT ?)",
+                (MAX_JOB_HISTORY,),
+            )
+
+    def _run(self, record, lock_file):
+        started = time.perf_counter()
+
+        def on_progress(done, total):
+            elapsed = time.perf_counter() - started
+            rate = done / elapsed if elapsed > 0 else None
+            record["progress"] = {
+                "done": done,
+                "total": total,
+                "rate": round(rate, 2) if rate else None,
+                "eta_seconds": round((total - done) / rate, 1) if rate else None,
+            }
+            with self.lock:
+                self._save(record)
+
+        try:
+            print(f">>> Import {record['import_id']} started ({record['reason']}).", flush=True)
+            if record["reconcile"]:
+                report = reconcile(self.milvus_manager, extractor=self.extractor, progress_callback=on_progress)
+                summary = dict(report.pop("import"), reconcile=report)
+            else:
+                summary = run_import(self.milvus_manager, extractor=self.extractor, progress_callback=on_progress)
+            record.update(status="done", result={key: value for key, value in summary.items() if key != "stages"})
+        except Exception as e:
+            print(f"❌ Error in import: {e}", flush=True)
+            record.update(status="error", error=str(e))
+        finally:
+            record["finished_at"] = time.time()
+            with self.lock:
+                self._save(record)
+            lock_file.close()
+            if self.on_complete:
+                self.on_complete()
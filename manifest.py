@@ -0,0 +1,123 @@
+import os
+import json
+import fcntl
+import hashlib
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMPORT_MANIFEST_PATH = os.getenv('IMPORT_MANIFEST_PATH', './import_manifest.db')
+MANIFEST_QUERY_CHUNK = 500
+
+def acquire_lock(path, shared=False, wait=True, on_wait=None):
+    """
+    Takes an flock on `path` and returns the open lock file; closing it
+    releases the lock. If another process holds it, returns None when
+    `wait` is False, otherwise calls `on_wait` once and blocks.
+    """
+    lock_file = open(path, "w")
+    mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    try:
+        fcntl.flock(lock_file, mode | fcntl.LOCK_NB)
+    except BlockingIOError:
+        if not wait:
+            lock_file.close()
+            return None
+        if on_wait:
+            on_wait()
+        fcntl.flock(lock_file, mode)
+    return lock_file
+
+def lock_manifest(wait=False, on_wait=None):
+    """Takes the import lock; returns the open lock file, or None if an import holds it and `wait` is False."""
+    return acquire_lock(IMPORT_MANIFEST_PATH + ".lock", wait=wait, on_wait=on_wait)
+
+def wait_message(what):
+    return lambda: print(f"⏳ Waiting for {what} to finish...", flush=True)
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ImportManifest:
+    """
+    Persistent record of which files under DATA_DIR are embedded, keyed by
+    their path relative to DATA_DIR. Each entry keeps the size, mtime and
+    content hash the vector was computed from, plus the Milvus ids holding it.
+    """
+
+    def __init__(self, path=IMPORT_MANIFEST_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha1 TEXT, ids TEXT)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def entries(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT path, size, mtime, sha1, ids FROM files").fetchall()
+        return {
+            path: {"size": size, "mtime": mtime, "sha1": sha1, "ids": json.loads(ids)}
+            for path, size, mtime, sha1, ids in rows
+        }
+
+    def get(self, paths: list) -> dict:
+        """Like `entries()`, restricted to `paths`, using primary-key lookups instead of reading the whole table."""
+        paths = list(dict.fromkeys(paths))
+        rows = []
+        with self.lock:
+            for start in range(0, len(paths), MANIFEST_QUERY_CHUNK):
+                chunk = paths[start:start + MANIFEST_QUERY_CHUNK]
+                rows.extend(self.conn.execute(
+                    f"SELECT path, size, mtime, sha1, ids FROM files WHERE path IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall())
+        return {
+            path: {"size": size, "mtime": mtime, "sha1": sha1, "ids": json.loads(ids)}
+            for path, size, mtime, sha1, ids in rows
+        }
+
+    def record(self, entries: list):
+        """`entries` is a list of (rel_path, size, mtime, sha1, ids) tuples."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime, sha1, ids) VALUES (?, ?, ?, ?, ?)",
+                [(path, size, mtime, sha1, json.dumps(list(ids))) for path, size, mtime, sha1, ids in entries],
+            )
+
+    def remove(self, paths: list):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM meta")
+
+    def is_complete(self) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'complete'").fetchone()
+        return row is not None and row[0] == "1"
+
+    def set_complete(self, complete: bool):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', ?)", ("1" if complete else "0",)
+            )
+
+    def remap_ids(self, mapping: dict):
+        """Rewrites every entry's Milvus ids through `mapping` (old id -> new id), e.g. after copying the collection."""
+        with self.lock, self.conn:
+            rows = self.conn.execute("SELECT path, ids FROM files").fetchall()
+            self.conn.executemany(
+                "UPDATE files SET ids = ? WHERE path = ?",
+                [(json.dumps([mapping[i] for i in json.loads(ids) if i in mapping]), path) for path, ids in rows],
+            )
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from vector_store import pid_alive
+
+load_dotenv()
+
+# Where each process drops a snapshot of its metrics so /metrics on any
+# gunicorn worker can report the whole server. Empty disables sharing.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    kind = None
+    shared = True
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return json.dumps([str(labels[name]) for name in self.labelnames])
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return json.loads(json.dumps(self.values))
+
+    def merge(self, totals: dict, values: dict):
+        for key, value in values.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def samples(self, values: dict):
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, json.loads(key))), value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """
+    `aggregate` says how values from several processes combine: "sum",
+    "max", or "live" to report only the rendering process's own value (for
+    gauges a collector refreshes on every scrape).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), aggregate="sum"):
+        super().__init__(name, documentation, labelnames)
+        self.aggregate = aggregate
+        self.shared = aggregate != "live"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def merge(self, totals: dict, values: dict):
+        if self.aggregate == "sum":
+            return super().merge(totals, values)
+        for key, value in values.items():
+            totals[key] = max(totals.get(key, value), value)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][index] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, totals: dict, values: dict):
+        for key, entry in values.items():
+            total = totals.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], entry["buckets"])]
+            total["sum"] += entry["sum"]
+            total["count"] += entry["count"]
+
+    def samples(self, values: dict):
+        for key, entry in sorted(values.items()):
+            labels = dict(zip(self.labelnames, json.loads(key)))
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                cumulative += count
+                yield f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative
+            yield f"{self.name}_sum", labels, entry["sum"]
+            yield f"{self.name}_count", labels, entry["count"]
+
+class Registry:
+    """
+    Holds this process's metrics and renders them in the Prometheus text
+    format. With a `metrics_dir`, every process also writes its snapshot
+    there (see `start_flusher`) and `render()` adds up the snapshots of all
+    live processes, so any gunicorn worker can answer for the whole server.
+    """
+
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics = []
+        self.metrics_dir = metrics_dir
+        self.collectors = []
+        self.flusher = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        """`collector()` runs before every render, e.g. to refresh gauges read from Milvus."""
+        self.collectors.append(collector)
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.metrics_dir, f"{pid}.json")
+
+    def flush(self):
+        if not self.metrics_dir:
+            return
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump({metric.name: metric.snapshot() for metric in self.metrics}, f)
+        os.replace(path + ".tmp", path)
+
+    def start_flusher(self, interval=METRICS_FLUSH_SECONDS):
+        """Starts this process's snapshot thread; call again after fork."""
+        if not self.metrics_dir or (self.flusher and self.flusher.is_alive()):
+            return
+
+        def run():
+            while True:
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"⚠️ Could not write metrics snapshot: {e}", flush=True)
+                time.sleep(interval)
+
+        self.flusher = threading.Thread(target=run, name="metrics-flush", daemon=True)
+        self.flusher.start()
+
+    def _snapshots(self):
+        snapshots = [{metric.name: metric.snapshot() for metric in self.metrics}]
+        if not self.metrics_dir or not os.path.isdir(self.metrics_dir):
+            return snapshots
+
+        for entry in os.listdir(self.metrics_dir):
+            pid, ext = os.path.splitext(entry)
+            if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            if not pid_alive(int(pid)):
+                try:
+                    os.remove(os.path.join(self.metrics_dir, entry))
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(self.metrics_dir, entry)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}", flush=True)
+
+        snapshots = self._snapshots()
+        lines = []
+        for metric in self.metrics:
+            totals = {}
+            for snapshot in snapshots if metric.shared else snapshots[:1]:
+                metric.merge(totals, snapshot.get(metric.name, {}))
+
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples(totals):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+REQUESTS = Counter("image_search_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"))
+ERRORS = Counter("image_search_errors_total", "HTTP requests that ended with a 5xx status.", ("endpoint",))
+IN_FLIGHT = Gauge("image_search_in_flight_requests", "HTTP requests currently being served.", ("endpoint",))
+REQUEST_SECONDS = Histogram("image_search_request_seconds", "End-to-end HTTP request latency.", ("endpoint",))
+STAGE_SECONDS = Histogram(
+    "image_search_stage_seconds",
+    "Latency of each processing stage (decode, preprocess, inference, search, post_process, ...).",
+    ("endpoint", "stage"),
+)
+COLLECTION_ENTITIES = Gauge("image_search_collection_entities", "Vectors stored in the Milvus collection.",
+                            aggregate="live")
+MODEL_LOAD_SECONDS = Gauge("image_search_model_load_seconds", "Time taken to load the feature extractor.",
+                           aggregate="max")
+
+def observe_stages(endpoint: str, timings: dict):
+    """Records `{stage: seconds}` (as filled in by `extract_batch(timings=...)`) for `endpoint`."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, endpoint=endpoint, stage=stage)
@@ -0,0 +1,77 @@
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from extractor import FEATURE_DIMENSION
+from milvus_db import MilvusManager, SCALAR_FIELDS
+from manifest import ImportManifest
+
+load_dotenv()
+
+def migrate_schema(batch_size=1000, keep_legacy=False):
+    """
+    Copies a collection created with dynamic name_key/filename fields into
+    one with the typed, indexed schema, keeping every vector and its
+    partition. content_hash is filled in from the import manifest, whose ids
+    are then rewritten to the new rows. Stop the API while this runs.
+    """
+    try:
+        source = MilvusManager(dimension=FEATURE_DIMENSION)
+    except Exception as e:
+        print(f"❌ Error connecting to Milvus: {e}")
+        print("⚠️  Hint: start 'python vector_store.py serve' to share the database with the running API.")
+        return
+
+    if source.typed_schema:
+        print(f"✅ Collection '{source.collection_name}' already has typed metadata fields.", flush=True)
+        return
+
+    client = source.client
+    name = source.collection_name
+    staging_name, legacy_name = f"{name}_migrating", f"{name}_legacy"
+    for leftover in (staging_name, legacy_name):
+        if client.has_collection(leftover):
+            raise RuntimeError(f"Collection '{leftover}' exists from an earlier run; drop or rename it first.")
+
+    manifest = ImportManifest()
+    hashes = {i: entry['sha1'] for entry in manifest.entries().values() for i in entry['ids']}
+    target = MilvusManager(dimension=FEATURE_DIMENSION, collection_name=staging_name,
+                           index_type=source.index_type, index_params=source.index_params)
+
+    print(f">>> Copying '{name}' into the typed schema...", flush=True)
+    mapping = {}
+
+    def copy(rows):
+        res = target.insert_batch({
+            "vector": np.asarray([row['vector'] for row in rows], dtype=np.float32),
+            "name_key": [row.get('name_key') or "" for row in rows],
+            "filename": [row.get('filename') or "" for row in rows],
+            "category": [row.get('category') or "" for row in rows],
+            "content_hash": [row.get('content_hash') or hashes.get(row['id'], "") for row in rows],
+        })
+        mapping.update(zip((row['id'] for row in rows), res["ids"]))
+
+    rows = []
+    for row in source.iter_rows(["vector", *SCALAR_FIELDS], batch_size=batch_size):
+        rows.append(row)
+        if len(rows) >= batch_size:
+            copy(rows)
+            rows = []
+    if rows:
+        copy(rows)
+
+    client.rename_collection(name, legacy_name)
+    client.rename_collection(staging_name, name)
+    manifest.remap_ids(mapping)
+    if not keep_legacy:
+        client.drop_collection(legacy_name)
+
+    print(f"✅ Migrated {len(mapping)} vectors." + (f" Old collection kept as '{legacy_name}'." if keep_legacy else ""),
+          flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move a collection with dynamic metadata fields to the typed schema.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--keep-legacy", action="store_true", help="Keep the old collection as <name>_legacy")
+    args = parser.parse_args()
+
+    migrate_schema(args.batch_size, args.keep_legacy)
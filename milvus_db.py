@@ -1,51 +1,414 @@
 import os
+import json
+import re
+import hashlib
+import threading
+import numpy as np
 from dotenv import load_dotenv
-from pymilvus import MilvusClient
+from pymilvus import MilvusClient, DataType
 from extractor import FEATURE_DIMENSION
+from vector_store import read_broker_uri
 
 load_dotenv()
 
 MILVUS_DB_PATH = os.getenv("MILVUS_DB_PATH", "./milvus.db")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "image_embeddings")
+EXISTS_QUERY_CHUNK = int(os.getenv("EXISTS_QUERY_CHUNK", 500))
+
+METRIC_TYPE = "COSINE"
+SUPPORTED_INDEX_TYPES = ("AUTOINDEX", "FLAT", "IVF_FLAT", "IVF_SQ8", "HNSW")
+INDEX_TYPE = os.getenv("INDEX_TYPE", "AUTOINDEX").upper()
+INDEX_PARAMS = json.loads(os.getenv("INDEX_PARAMS") or "{}")
+SEARCH_PARAMS = json.loads(os.getenv("SEARCH_PARAMS") or "{}")
+MAX_SEARCH_LIMIT = 16384
+DEFAULT_PARTITION = "_default"
+SCALAR_INDEX_TYPE = os.getenv("SCALAR_INDEX_TYPE", "INVERTED").upper()
+# Typed metadata fields and their VARCHAR max_length. Collections created
+# before these existed keep them as dynamic fields (see migrate_schema.py).
+SCALAR_FIELDS = {"name_key": 512, "filename": 512, "category": 256, "content_hash": 64}
+
+def group_hits(hits, top_k_groups: int, hits_per_group: int) -> list:
+    """Folds ranked hits into at most `top_k_groups` name_key groups of `hits_per_group` hits each."""
+    groups = {}
+    for hit in hits:
+        entity = hit["entity"]
+        name_key = entity.get("name_key")
+        if not name_key:
+            continue
+
+        group = groups.get(name_key)
+        if group is None:
+            if len(groups) >= top_k_groups:
+                continue
+            group = groups[name_key] = {
+                "name_key": name_key,
+                "score": round(float(hit["distance"]), 4),
+                "hits": [],
+            }
+        if len(group["hits"]) < hits_per_group:
+            group["hits"].append({
+                "filename": entity.get("filename"),
+                "score": round(float(hit["distance"]), 4),
+            })
+
+    return list(groups.values())
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(uri: str) -> MilvusClient:
+    """Returns this process's shared client for `uri`; one gRPC channel serves every thread."""
+    with _clients_lock:
+        if uri not in _clients:
+            _clients[uri] = MilvusClient(uri=uri)
+        return _clients[uri]
+
+def resolve_uri(uri=None) -> str:
+    """
+    Explicit uri, then MILVUS_URI, then the running vector-store broker (see
+    vector_store.py), and only then opening MILVUS_DB_PATH directly.
+    """
+    return uri or os.getenv("MILVUS_URI") or read_broker_uri() or MILVUS_DB_PATH
+
+def as_vectors(vectors):
+    """
+    Returns query or insert vectors in the form pymilvus packs cheapest: the
+    rows of a C-contiguous float32 array (views, no copy) for NumPy input,
+    or the lists unchanged.
+    """
+    if isinstance(vectors, np.ndarray):
+        return list(np.ascontiguousarray(vectors, dtype=np.float32))
+    return [np.ascontiguousarray(vector, dtype=np.float32) if isinstance(vector, np.ndarray) else vector
+            for vector in vectors]
+
+def partition_name(category) -> str:
+    """
+    Milvus partition holding `category`'s rows. Category folder names may
+    contain any characters, partition names only [A-Za-z0-9_], so named
+    categories map to a hash; rows without a category stay in _default.
+    """
+    if not category:
+        return DEFAULT_PARTITION
+    return "cat_" + hashlib.sha1(category.encode("utf-8")).hexdigest()[:16]
+
+def deleted_count(res) -> int:
+    """Number of rows a delete removed; pymilvus returns either the primary keys or a delete_count."""
+    if isinstance(res, list):
+        return len(res)
+    return res.get("delete_count", 0) if res else 0
+
+def grouping_rejected(error) -> bool:
+    """True when the server refused `group_by_field` itself, as opposed to a transient search failure."""
+    return re.search(r"group[ _]?by", str(error), re.IGNORECASE) is not None
+
+def quote_list(values) -> str:
+    """Render values as a Milvus filter list literal, escaping quotes the JSON way."""
+    return json.dumps(list(values), ensure_ascii=False)
+
+def build_filter(name_keys=None, exclude_name_keys=None) -> str:
+    """Filter expression restricting results to `name_keys` and/or leaving out `exclude_name_keys`."""
+    clauses = []
+    if name_keys:
+        clauses.append(f"name_key in {quote_list(name_keys)}")
+    if exclude_name_keys:
+        clauses.append(f"name_key not in {quote_list(exclude_name_keys)}")
+    return " and ".join(clauses)
 
 class MilvusManager:
-    def __init__(self, uri=MILVUS_DB_PATH, dimension=FEATURE_DIMENSION, collection_name=COLLECTION_NAME):
-        self.client = MilvusClient(uri=uri)
+    def __init__(self, uri=None, dimension=FEATURE_DIMENSION, collection_name=COLLECTION_NAME,
+                 index_type=INDEX_TYPE, index_params=INDEX_PARAMS, search_params=SEARCH_PARAMS):
+        uri = resolve_uri(uri)
+        self.client = get_client(uri)
         self.collection_name = collection_name
+        self.index_type = index_type
+        self.index_params = index_params
+        self.search_params = search_params
+        self.grouping_supported = True
+        self.fields = set()
+        self.partitions = set()
+        self.partitions_lock = threading.Lock()
+
+        if uri.endswith(".db") and index_type not in ("AUTOINDEX", "FLAT"):
+            print(f"⚠️ milvus-lite may ignore INDEX_TYPE={index_type} and fall back to FLAT.")
+
         self._setup_collection(dimension)
 
+    def _build_index_params(self, index_type, params, scalar_fields=()):
+        if index_type not in SUPPORTED_INDEX_TYPES:
+            raise ValueError(f"Unsupported index type '{index_type}', expected one of {SUPPORTED_INDEX_TYPES}")
+
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(
+            field_name="vector",
+            index_type=index_type,
+            metric_type=METRIC_TYPE,
+            params=params,
+        )
+        for field in scalar_fields:
+            index_params.add_index(field_name=field, index_type=SCALAR_INDEX_TYPE, index_name=f"{field}_index")
+        return index_params
+
     def _setup_collection(self, dimension):
         if self.client.has_collection(self.collection_name):
+            # A broker reopening an existing .db starts with its collections released.
+            self.client.load_collection(self.collection_name)
+            self._describe()
+            if not self.typed_schema:
+                print(f"⚠️ Collection '{self.collection_name}' stores metadata as dynamic fields; "
+                      f"filters scan every row. Run 'python migrate_schema.py' to add typed, indexed fields.",
+                      flush=True)
             return
 
         try:
+            schema = self.client.create_schema(auto_id=True, enable_dynamic_field=True)
+            schema.add_field("id", DataType.INT64, is_primary=True)
+            schema.add_field("vector", DataType.FLOAT_VECTOR, dim=dimension)
+            schema.add_field("name_key", DataType.VARCHAR, max_length=SCALAR_FIELDS["name_key"])
+            schema.add_field("filename", DataType.VARCHAR, max_length=SCALAR_FIELDS["filename"])
+            schema.add_field("category", DataType.VARCHAR, max_length=SCALAR_FIELDS["category"], default_value="")
+            schema.add_field("content_hash", DataType.VARCHAR, max_length=SCALAR_FIELDS["content_hash"],
+                             default_value="")
+
             self.client.create_collection(
                 collection_name=self.collection_name,
-                dimension=dimension,
-                primary_field_name="id",
-                vector_field_name="vector",
-                id_type="int",
-                auto_id=True,
-                enable_dynamic_field=True,
-                metric_type="COSINE",
+                schema=schema,
+                index_params=self._build_index_params(self.index_type, self.index_params, SCALAR_FIELDS),
             )
         except Exception as e:
             print(f"Error creating collection: {e}")
             raise e
+        self._describe()
+
+    def _describe(self):
+        description = self.client.describe_collection(self.collection_name)
+        self.fields = {field["name"] for field in description["fields"]}
+        # Grouping search needs name_key to be a real schema field, not a dynamic one.
+        self.grouping_supported = "name_key" in self.fields
+        self.partitions = set(self.client.list_partitions(self.collection_name))
+
+    @property
+    def typed_schema(self) -> bool:
+        return set(SCALAR_FIELDS) <= self.fields
+
+    def _ensure_partition(self, name):
+        with self.partitions_lock:
+            if name in self.partitions:
+                return
+            if not self.client.has_partition(self.collection_name, name):
+                self.client.create_partition(self.collection_name, name)
+            self.partitions.add(name)
+
+    def search_partitions(self, category):
+        """
+        Partition names to search for `category` (a name or a list of names),
+        or None to search everything. Categories with no partition yet are
+        dropped, so the result may be an empty list.
+        """
+        if not category:
+            return None
+        categories = [category] if isinstance(category, str) else list(category)
+        names = {partition_name(name) for name in categories}
+        if not names <= self.partitions:
+            # Another process may have created them since we last looked.
+            with self.partitions_lock:
+                self.partitions = set(self.client.list_partitions(self.collection_name))
+        return sorted(names & self.partitions)
+
+    def rebuild_index(self, index_type=None, params=None):
+        """Drops the vector index and builds it again with the given (or configured) settings."""
+        index_type = (index_type or self.index_type).upper()
+        params = self.index_params if params is None else params
+        index_params = self._build_index_params(index_type, params)
+
+        self.client.release_collection(self.collection_name)
+        for index_name in self.client.list_indexes(self.collection_name, field_name="vector"):
+            self.client.drop_index(self.collection_name, index_name)
+
+        self.client.create_index(self.collection_name, index_params)
+        self.client.load_collection(self.collection_name)
+
+        self.index_type = index_type
+        self.index_params = params
+
+    def insert_batch(self, data):
+        """
+        Inserts rows given either as a list of dicts or in columnar form,
+        `{"vector": (N, D) float32 array, "name_key": [...], ...}`. Columnar
+        vectors reach pymilvus as row views of the array, never as lists.
 
-    def insert_batch(self, data: list):
+        Rows with a "category" go to that category's partition. The returned
+        "ids" are in input order whichever partitions the rows landed in.
+        """
+        if isinstance(data, dict):
+            vectors = as_vectors(data["vector"])
+            columns = {field: values for field, values in data.items() if field != "vector"}
+            data = [
+                dict({field: values[index] for field, values in columns.items()}, vector=vector)
+                for index, vector in enumerate(vectors)
+            ]
         if not data:
             return
-        return self.client.insert(self.collection_name, data)
 
-    def search_images(self, query_vector: list, limit: int = 10):
+        by_partition = {}
+        for index, row in enumerate(data):
+            by_partition.setdefault(partition_name(row.get("category")), []).append(index)
+        if list(by_partition) == [DEFAULT_PARTITION]:
+            return self.client.insert(self.collection_name, data)
+
+        ids = [None] * len(data)
+        for name, indexes in by_partition.items():
+            self._ensure_partition(name)
+            res = self.client.insert(self.collection_name, [data[index] for index in indexes], partition_name=name)
+            for index, new_id in zip(indexes, res["ids"]):
+                ids[index] = new_id
+        return {"insert_count": len(data), "ids": ids}
+
+    def search_images(self, query_vector, limit: int = 10, search_params: dict = None, category=None,
+                      filter: str = ""):
+        return self.search_batch([query_vector], limit=limit, search_params=search_params, category=category,
+                                 filter=filter)
+
+    def search_batch(self, query_vectors, limit: int = 10, search_params: dict = None, category=None,
+                     filter: str = "", output_fields=("filename", "name_key")):
+        """
+        `query_vectors` may be a list of lists or an (N, D) float32 array.
+        `search_params` (e.g. {"nprobe": 32} or {"ef": 128}) override SEARCH_PARAMS for this call.
+        `category` (a name or list of names) restricts the search to those partitions.
+        `filter` is a Milvus boolean expression over the metadata fields, see `build_filter`.
+        """
+        params = dict(self.search_params, **(search_params or {}))
+        partitions = self.search_partitions(category)
+        if partitions == []:
+            return [[] for _ in range(len(query_vectors))]
+
         return self.client.search(
             self.collection_name,
-            data=[query_vector],
-            output_fields=["filename", "name_key"],
-            search_params={"metric_type": "COSINE", "params": {}},
+            data=as_vectors(query_vectors),
+            output_fields=list(output_fields),
+            search_params={"metric_type": METRIC_TYPE, "params": params},
             limit=limit,
+            partition_names=partitions,
+            filter=filter,
+        )
+
+    def search_grouped(self, query_vectors, top_k_groups: int = 10, hits_per_group: int = 1,
+                       search_params: dict = None, category=None, filter: str = ""):
+        """
+        Returns, per query vector, up to `top_k_groups` distinct name_key groups
+        with their best `hits_per_group` hits. Uses Milvus grouping search when
+        name_key is a schema field and the server supports it, otherwise
+        over-fetches and widens `limit` until enough distinct groups are found.
+        """
+        params = dict(self.search_params, **(search_params or {}))
+        partitions = self.search_partitions(category)
+        if partitions == []:
+            return [[] for _ in range(len(query_vectors))]
+
+        if self.grouping_supported:
+            try:
+                results = self.client.search(
+                    self.collection_name,
+                    data=as_vectors(query_vectors),
+                    output_fields=["filename", "name_key"],
+                    search_params={"metric_type": METRIC_TYPE, "params": params},
+                    limit=top_k_groups,
+                    group_by_field="name_key",
+                    group_size=hits_per_group,
+                    partition_names=partitions,
+                    filter=filter,
+                )
+                return [group_hits(hits, top_k_groups, hits_per_group) for hits in results]
+            except Exception as e:
+                if not grouping_rejected(e):
+                    raise
+                print(f"⚠️ Grouping search unavailable, falling back to over-fetch: {e}", flush=True)
+                self.grouping_supported = False
+
+        limit = min(top_k_groups * hits_per_group * 2, MAX_SEARCH_LIMIT)
+        while True:
+            results = self.search_batch(query_vectors, limit=limit, search_params=search_params, category=category,
+                                        filter=filter)
+            grouped = [group_hits(hits, top_k_groups, hits_per_group) for hits in results]
+
+            done = all(len(groups) >= top_k_groups or len(hits) < limit
+                       for hits, groups in zip(results, grouped))
+            if done or limit >= MAX_SEARCH_LIMIT:
+                return grouped
+            limit = min(limit * 4, MAX_SEARCH_LIMIT)
+
+    def delete_ids(self, ids: list):
+        if not ids:
+            return
+        return self.client.delete(self.collection_name, ids=[int(i) for i in ids])
+
+    def delete_by_name_key(self, name_keys, category: str = None) -> int:
+        """
+        Deletes every vector of the given name_key group(s), only within
+        `category` when given, and returns how many were removed.
+        """
+        name_keys = [name_keys] if isinstance(name_keys, str) else list(name_keys)
+        if not name_keys:
+            return 0
+        expr = f"name_key in {quote_list(name_keys)}"
+        if category:
+            expr += f" and category in {quote_list([category])}"
+        res = self.client.delete(self.collection_name, filter=expr)
+        return deleted_count(res)
+
+    def delete_by_filename(self, filename: str, name_key: str = None, category: str = None) -> int:
+        """Deletes the vectors stored for `filename`, only within `name_key` / `category` when given."""
+        expr = f"filename in {quote_list([filename])}"
+        if name_key is not None:
+            expr += f" and name_key in {quote_list([name_key])}"
+        if category:
+            expr += f" and category in {quote_list([category])}"
+        res = self.client.delete(self.collection_name, filter=expr)
+        return deleted_count(res)
+
+    def upsert_batch(self, data, old_ids=None):
+        """
+        Like `insert_batch`, but deletes the rows with the same (category,
+        name_key, filename) once the new vectors are in, so a replaced image
+        never has zero or two vectors for long. Callers that already looked
+        the old rows up pass their ids as `old_ids`. The ids are
+        auto-generated, so Milvus' own upsert (which matches on the primary
+        key) does not apply.
+        """
+        if old_ids is None:
+            rows = data if not isinstance(data, dict) else [
+                {field: values[index] for field, values in data.items() if field != "vector"}
+                for index in range(len(data["name_key"]))
+            ]
+            wanted = {(row.get("category") or "", row["name_key"], row["filename"]) for row in rows}
+            old_ids = [
+                row["id"] for row in self.file_rows([(name_key, filename) for _, name_key, filename in wanted])
+                if (row.get("category") or "", row.get("name_key"), row.get("filename")) in wanted
+            ]
+
+        res = self.insert_batch(data)
+        self.delete_ids(old_ids)
+        return dict(res or {}, replaced_ids=old_ids)
+
+    def iter_rows(self, output_fields: list, batch_size: int = 1000):
+        """Yields every row in the collection, paging with a query iterator."""
+        iterator = self.client.query_iterator(
+            self.collection_name,
+            batch_size=batch_size,
+            filter="id >= 0",
+            output_fields=output_fields,
         )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            iterator.close()
+
+    def count(self) -> int:
+        res = self.client.query(self.collection_name, filter="", output_fields=["count(*)"])
+        return res[0]["count(*)"] if res else 0
 
     def has_data(self):
         try:
@@ -59,15 +422,43 @@ class MilvusManager:
         except:
             return False
     
-    def check_file_exists(self, filename: str):
+    def file_rows(self, pairs: list) -> list:
+        """
+        Returns the rows (id, name_key, filename, category) stored for the
+        given `(name_key, filename)` pairs, using one `filename in [...]`
+        query per EXISTS_QUERY_CHUNK distinct filenames.
+        """
+        wanted = set(pairs)
+        filenames = sorted({filename for _, filename in wanted})
+        rows = []
+
+        for start in range(0, len(filenames), EXISTS_QUERY_CHUNK):
+            chunk = filenames[start:start + EXISTS_QUERY_CHUNK]
+            res = self.client.query(
+                self.collection_name,
+                filter=f"filename in {quote_list(chunk)}",
+                output_fields=["name_key", "filename", "category"],
+            )
+            rows.extend(row for row in res if (row.get("name_key"), row.get("filename")) in wanted)
+
+        return rows
+
+    def existing_files(self, pairs: list) -> set:
+        """Returns the subset of `(name_key, filename)` pairs that already have a vector."""
+        return {(row.get("name_key"), row.get("filename")) for row in self.file_rows(pairs)}
+
+    def check_file_exists(self, filename: str, name_key: str = None):
         try:
+            if name_key is not None:
+                return bool(self.existing_files([(name_key, filename)]))
+
             res = self.client.query(
                 self.collection_name,
-                filter=f'filename == "{filename}"',
+                filter=f"filename in {quote_list([filename])}",
                 output_fields=["id"],
                 limit=1
             )
             return len(res) > 0
         except Exception as e:
             print(f"Check exists error: {e}")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 4))
+
+class StageStats:
+    """Thread-safe item count and busy time for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self.lock:
+            self.items += items
+            self.seconds += seconds
+
+    def rate(self):
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.items} items in {self.seconds:.1f}s busy ({self.rate():.1f}/s)"
+
+class ImportPipeline:
+    """
+    Producer/consumer import: a pool of `workers` threads decodes and
+    preprocesses batches of images into ready tensors (PIL decoding and the
+    image processor release the GIL), while the calling thread runs batched
+    inference and hands each batch to `sink`. At most `queue_size` prepared
+    batches wait in memory; when inference falls behind, the producer blocks.
+    """
+
+    def __init__(self, extractor, batch_size, workers=DECODE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
+        self.extractor = extractor
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stats = {name: StageStats(name) for name in ("decode", "preprocess", "inference", "sink")}
+        self.producer_blocked = 0.0
+        self.consumer_starved = 0.0
+
+    def _prepare(self, tasks):
+        images, ok_tasks, failed = [], [], {}
+
+        start = time.perf_counter()
+        for index, task in enumerate(tasks):
+            try:
+                images.append(self.extractor.load_image(task['path']))
+                ok_tasks.append(task)
+            except Exception as e:
+                failed[index] = str(e)
+        self.stats["decode"].add(len(tasks), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        pixel_values = None
+        try:
+            if images:
+                pixel_values = self.extractor.preprocess(images)
+        except Exception as e:
+            failed.update({index: str(e) for index in range(len(tasks)) if index not in failed})
+            ok_tasks = []
+        self.stats["preprocess"].add(len(images), time.perf_counter() - start)
+
+        return tasks, ok_tasks, pixel_values, failed
+
+    def _put(self, ready, item, stop):
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, tasks, pool, ready, stop):
+        try:
+            for start in range(0, len(tasks), self.batch_size):
+                future = pool.submit(self._prepare, tasks[start:start + self.batch_size])
+                wait_start = time.perf_counter()
+                queued = self._put(ready, future, stop)
+                self.producer_blocked += time.perf_counter() - wait_start
+                if not queued:
+                    return
+        finally:
+            self._put(ready, None, stop)
+
+    def run(self, tasks, sink):
+        """
+        Embeds `tasks` (dicts with a 'path') and calls
+        `sink(batch_tasks, ok_tasks, vectors, failed)` once per batch, in order.
+        """
+        ready = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decode") as pool:
+            producer = threading.Thread(target=self._produce, args=(tasks, pool, ready, stop), daemon=True)
+            producer.start()
+            try:
+                while True:
+                    wait_start = time.perf_counter()
+                    future = ready.get()
+                    if future is None:
+                        break
+                    batch_tasks, ok_tasks, pixel_values, failed = future.result()
+                    self.consumer_starved += time.perf_counter() - wait_start
+
+                    try:
+                        vectors = None
+                        if pixel_values is not None:
+                            start = time.perf_counter()
+                            vectors = self.extractor.embed(pixel_values)
+                            self.stats["inference"].add(len(ok_tasks), time.perf_counter() - start)
+
+                        start = time.perf_counter()
+                        sink(batch_tasks, ok_tasks, vectors, failed)
+                        self.stats["sink"].add(len(ok_tasks), time.perf_counter() - start)
+                    except Exception as e:
+                        print(f"Error processing batch starting at {batch_tasks[0]['path']}: {e}", flush=True)
+            finally:
+                stop.set()
+                producer.join()
+
+    def report(self):
+        lines = [str(stage) for stage in self.stats.values()]
+        lines.append(f"producer blocked {self.producer_blocked:.1f}s, consumer starved {self.consumer_starved:.1f}s")
+        return lines
@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import uuid
+import pstats
+import shutil
+import argparse
+import cProfile
+import tempfile
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+PROFILE_DIR = os.getenv('PROFILE_DIR', './profiles')
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', 25))
+SAMPLE_INTERVAL_MS = float(os.getenv('SAMPLE_INTERVAL_MS', 5))
+PROFILE_MODES = ("cprofile", "torch")
+
+# cProfile (a global sys.monitoring tool on Python 3.12+) and the torch
+# profiler are process-wide, so only one request thread may profile at a time.
+_profile_lock = threading.Lock()
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+def new_profile_path(suffix: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}{suffix}")
+
+def cprofile_call(fn, *args, **kwargs):
+    """
+    Runs `fn` under cProfile and saves the stats next to the other traces
+    (open with `python -m pstats` or snakeviz). Returns `(result, report)`
+    where the report lists the top functions by cumulative time.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args, **kwargs)
+
+    path = new_profile_path(".prof")
+    profiler.dump_stats(path)
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_N]
+    top = [{
+        "function": f"{os.path.basename(filename)}:{line}({name})",
+        "calls": calls,
+        "total_ms": round(total * 1000, 3),
+        "cumulative_ms": round(cumulative * 1000, 3),
+    } for (filename, line, name), (_, calls, total, cumulative, _) in rows]
+    return result, {"mode": "cprofile", "path": path, "top": top}
+
+def torch_profile_call(fn, *args, **kwargs):
+    """Like `cprofile_call`, but records torch operators and writes a Chrome trace (chrome://tracing, Perfetto)."""
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+
+    with profile(activities=activities, record_shapes=True) as prof:
+        result = fn(*args, **kwargs)
+
+    path = new_profile_path(".json")
+    prof.export_chrome_trace(path)
+    events = sorted(prof.key_averages(), key=lambda event: event.cpu_time_total, reverse=True)[:PROFILE_TOP_N]
+    top = [{
+        "function": event.key,
+        "calls": event.count,
+        "total_ms": round(event.self_cpu_time_total / 1000, 3),
+        "cumulative_ms": round(event.cpu_time_total / 1000, 3),
+    } for event in events]
+    return result, {"mode": "torch", "path": path, "top": top}
+
+def profile_call(mode, fn, *args, **kwargs):
+    """Runs `fn` under the `mode` profiler; raises ProfilerBusy if another thread is already profiling."""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("Another profiled request is running, try again later")
+    try:
+        if mode == "torch":
+            return torch_profile_call(fn, *args, **kwargs)
+        return cprofile_call(fn, *args, **kwargs)
+    finally:
+        _profile_lock.release()
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of every thread each `interval_ms` and counts
+    identical stacks, so the result covers the decode pool and the inference
+    thread alike. `write_folded()` emits the collapsed-stack format read by
+    flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, interval_ms=SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.stacks = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def profile_import(images=200, data_dir=None, output=None, use_cache=False, interval_ms=SAMPLE_INTERVAL_MS):
+    """
+    Imports the first `images` files of `data_dir` into a scratch collection
+    under the sampling profiler and writes the folded stacks to `output`.
+    """
+    from extractor import FeatureExtractor, MODEL_NAME
+    from milvus_db import MilvusManager
+    from manifest import ImportManifest
+    from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_DIR
+    from import_data import run_import, collect_tasks, DATA_DIR
+
+    data_dir = data_dir or DATA_DIR
+    tasks = sorted(collect_tasks(data_dir), key=lambda task: task['rel_path'])[:images]
+    if not tasks:
+        print(f"Folder '{data_dir}' is empty.", flush=True)
+        return None
+
+    output = output or new_profile_path(".folded")
+    work_dir = tempfile.mkdtemp(prefix="profile_import_")
+    try:
+        extractor = FeatureExtractor(MODEL_NAME)
+        milvus_manager = MilvusManager(uri=os.path.join(work_dir, "profile.db"),
+                                       dimension=extractor.hidden_size, collection_name="profile_import")
+        cache = EmbeddingCache(dimension=extractor.hidden_size, backend=extractor.backend,
+                               preprocess_version=extractor.preprocess_version,
+                               cache_dir=EMBEDDING_CACHE_DIR if use_cache else os.path.join(work_dir, "embedding_cache"))
+
+        with SamplingProfiler(interval_ms) as profiler:
+            summary = run_import(
+                milvus_manager,
+                tasks=tasks,
+                manifest=ImportManifest(os.path.join(work_dir, "import_manifest.db")),
+                cache=cache,
+                extractor=extractor,
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    profiler.write_folded(output)
+    print(f">>> {profiler.samples} samples of {len(tasks)} images in {summary['seconds']}s written to {output}", flush=True)
+    print(f"    Render with: flamegraph.pl {output} > import.svg  (or load it in speedscope.app)", flush=True)
+    return output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile run_import with a sampling profiler.")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--output", default=None, help="Folded-stack file (default: a new file in PROFILE_DIR)")
+    parser.add_argument("--interval-ms", type=float, default=SAMPLE_INTERVAL_MS)
+    parser.add_argument("--use-cache", action="store_true", help="Reuse the shared embedding cache")
+    args = parser.parse_args()
+
+    if profile_import(args.images, args.data_dir, args.output, args.use_cache, args.interval_ms) is None:
+        raise SystemExit(1)
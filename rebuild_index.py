@@ -0,0 +1,27 @@
+import argparse
+import json
+from dotenv import load_dotenv
+from extractor import FEATURE_DIMENSION
+from milvus_db import MilvusManager, INDEX_TYPE, INDEX_PARAMS, SUPPORTED_INDEX_TYPES
+
+load_dotenv()
+
+def rebuild_index(index_type=INDEX_TYPE, params=INDEX_PARAMS):
+    print(f">>> Rebuilding vector index as {index_type} {params}...", flush=True)
+    try:
+        milvus_manager = MilvusManager(dimension=FEATURE_DIMENSION)
+    except Exception as e:
+        print(f"❌ Error connecting to Milvus: {e}")
+        print("⚠️  Hint: start 'python vector_store.py serve' to share the database with the running API.")
+        return
+
+    milvus_manager.rebuild_index(index_type, params)
+    print("✅ Index rebuilt.", flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the Milvus vector index.")
+    parser.add_argument("--index-type", default=INDEX_TYPE, choices=SUPPORTED_INDEX_TYPES)
+    parser.add_argument("--params", default=None, help='JSON build params, e.g. \'{"M": 16, "efConstruction": 200}\'')
+    args = parser.parse_args()
+
+    rebuild_index(args.index_type, json.loads(args.params) if args.params else INDEX_PARAMS)
@@ -0,0 +1,92 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 2048))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 600))
+RESULT_CACHE_EPOCH_PATH = os.getenv('RESULT_CACHE_EPOCH_PATH', './result_cache.epoch')
+
+class ResultCache:
+    """
+    Thread-safe LRU + TTL cache for final search responses, keyed by a hash
+    of the uploaded bytes and the search parameters. Memory is bounded by
+    `max_entries`, each entry being one small result page.
+
+    `invalidate()` also touches `epoch_path`; every process sharing that file
+    drops its entries on the next lookup, so all server workers see new data.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, epoch_path=RESULT_CACHE_EPOCH_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.epoch_path = epoch_path
+        self.epoch = self._read_epoch()
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes, **params) -> str:
+        digest = hashlib.sha256(image_bytes)
+        digest.update(repr(sorted(params.items())).encode())
+        return digest.hexdigest()
+
+    def _read_epoch(self):
+        try:
+            return os.stat(self.epoch_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self, key):
+        epoch = self._read_epoch()
+        with self.lock:
+            if epoch != self.epoch:
+                self.epoch = epoch
+                self.entries.clear()
+
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self):
+        with open(self.epoch_path, 'a'):
+            os.utime(self.epoch_path)
+        self.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
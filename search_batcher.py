@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+from metrics import STAGE_SECONDS, observe_stages
+
+load_dotenv()
+
+SEARCH_BATCH_WINDOW_MS = float(os.getenv('SEARCH_BATCH_WINDOW_MS', 10))
+SEARCH_MAX_BATCH = int(os.getenv('SEARCH_MAX_BATCH', 8))
+SEARCH_TIMEOUT = float(os.getenv('SEARCH_TIMEOUT', 30))
+
+class _PendingSearch:
+    def __init__(self, image_input, top_k_groups, hits_per_group, category=None, filter=""):
+        self.image_input = image_input
+        self.group_params = (top_k_groups, hits_per_group, tuple(category or ()), filter)
+        self.queued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SearchBatcher:
+    """
+    Collects query images that arrive within `window_ms` of each other (up to
+    `max_batch`) and serves them with one batched forward pass and one
+    multi-vector grouped Milvus search per distinct (top_k_groups,
+    hits_per_group, category, filter). Callers block in `search()` until their own groups are
+    ready.
+    """
+
+    def __init__(self, extractor, milvus_manager, window_ms=SEARCH_BATCH_WINDOW_MS, max_batch=SEARCH_MAX_BATCH):
+        self.extractor = extractor
+        self.milvus_manager = milvus_manager
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+
+        self.worker = threading.Thread(target=self._run, name="search-batcher", daemon=True)
+        self.worker.start()
+
+    def search(self, image_input, top_k_groups: int = 10, hits_per_group: int = 1, category=None,
+               filter: str = "", timeout: float = SEARCH_TIMEOUT):
+        """
+        Returns the name_key groups for `image_input`, or None if the image
+        could not be decoded. `category` is a list of categories to search
+        in and `filter` a Milvus filter expression.
+        """
+        pending = _PendingSearch(image_input, top_k_groups, hits_per_group, category, filter)
+        self.queue.put(pending)
+
+        if not pending.done.wait(timeout):
+            raise TimeoutError(f"Search did not complete within {timeout}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        for pending in batch:
+            STAGE_SECONDS.observe(started - pending.queued_at, endpoint="search_image", stage="queue")
+
+        timings = {}
+        vectors, failed = self.extractor.extract_batch(
+            [pending.image_input for pending in batch], batch_size=len(batch), timings=timings
+        )
+        observe_stages("search_image", timings)
+        ok_batch = [pending for index, pending in enumerate(batch) if index not in failed]
+
+        by_params = {}
+        for pending, vector in zip(ok_batch, vectors):
+            by_params.setdefault(pending.group_params, []).append((pending, vector))
+
+        for (top_k_groups, hits_per_group, category, filter), entries in by_params.items():
+            with STAGE_SECONDS.time(endpoint="search_image", stage="search"):
+                grouped = self.milvus_manager.search_grouped(
+                    [vector for _, vector in entries],
+                    top_k_groups=top_k_groups,
+                    hits_per_group=hits_per_group,
+                    category=list(category),
+                    filter=filter,
+                )
+            for (pending, _), groups in zip(entries, grouped):
+                pending.result = groups
@@ -0,0 +1,81 @@
+import os
+import time
+import threading
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WARMUP_BATCH_SIZES = [int(size) for size in os.getenv('WARMUP_BATCH_SIZES', '1,8,16').split(',') if size.strip()]
+
+class StartupController:
+    """
+    Runs the service's startup steps (load the model, connect to Milvus,
+    warm up, ...) in a background thread so the server can accept
+    connections right away. The process is live as soon as it exists and
+    ready once every step has finished; `status()` reports which step it is
+    on and how long each one took.
+    """
+
+    def __init__(self):
+        self.phase = "starting"
+        self.error = None
+        self.timings = {}
+        self.started_at = time.time()
+        self.ready_event = threading.Event()
+        self.thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_event.is_set()
+
+    def run_step(self, name, fn):
+        self.phase = name
+        print(f">>> Startup: {name}...", flush=True)
+        start = time.perf_counter()
+        fn()
+        self.timings[name] = round(time.perf_counter() - start, 3)
+
+    def run(self, steps):
+        try:
+            for name, fn in steps:
+                self.run_step(name, fn)
+        except Exception as e:
+            self.phase = "failed"
+            self.error = str(e)
+            print(f"❌ Startup failed during '{name}': {e}", flush=True)
+            return
+
+        self.phase = "ready"
+        self.ready_event.set()
+        print(f"✅ Ready in {time.time() - self.started_at:.1f}s {self.timings}", flush=True)
+
+    def start(self, steps):
+        """Runs `steps`, a list of `(name, fn)`, in order on a background thread."""
+        self.thread = threading.Thread(target=self.run, args=(steps,), name="startup", daemon=True)
+        self.thread.start()
+
+    def status(self) -> dict:
+        return {
+            "phase": self.phase,
+            "ready": self.ready,
+            "error": self.error,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "steps": dict(self.timings),
+        }
+
+def warm_up(extractor, milvus_manager=None, batch_sizes=WARMUP_BATCH_SIZES):
+    """
+    Runs synthetic forward passes at each batch size so torch has its
+    kernels and thread pools initialized before the first real query, then
+    one Milvus search to load the collection on the server side.
+    """
+    rng = np.random.default_rng(0)
+    vectors = None
+    for batch_size in batch_sizes:
+        images = [Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)) for _ in range(batch_size)]
+        vectors = extractor.embed(extractor.preprocess(images))
+
+    if milvus_manager is not None and vectors is not None:
+        milvus_manager.search_batch(vectors[:1], limit=1)
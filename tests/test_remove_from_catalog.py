@@ -0,0 +1,100 @@
+import os
+import pytest
+import add_data
+from manifest import ImportManifest
+
+
+class RecordingManager:
+    """Stands in for MilvusManager and records which deletes were asked for."""
+
+    def __init__(self):
+        self.calls = []
+
+    def delete_by_name_key(self, name_key, category=None):
+        self.calls.append(("name_key", name_key, category))
+        return 0
+
+    def delete_by_filename(self, filename, name_key=None, category=None):
+        self.calls.append(("filename", filename, name_key, category))
+        return 0
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x")
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    for rel_path in ("red/0.jpg", "red/1.jpg", "shoes/boot/0.jpg", "shoes/red/2.jpg", "bags/tote/0.jpg"):
+        touch(str(data_dir / rel_path))
+    touch(str(tmp_path / "outside.jpg"))
+
+    manifest_path = str(tmp_path / "manifest.db")
+    monkeypatch.setattr(add_data, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(add_data, "ImportManifest", lambda: ImportManifest(manifest_path))
+    return data_dir
+
+
+def files_under(root):
+    return sorted(os.path.relpath(os.path.join(dirpath, name), root)
+                  for dirpath, _, names in os.walk(root) for name in names)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"name_key": "."},
+    {"name_key": ".."},
+    {"name_key": ""},
+    {"name_key": "red/../.."},
+    {"name_key": "red", "filename": "../../outside.jpg"},
+    {"name_key": "red", "filename": ".."},
+    {"name_key": "boot", "category": ".."},
+    {"name_key": "boot", "category": "shoes/../.."},
+])
+def test_rejects_values_outside_data_dir(catalog, kwargs):
+    before = files_under(catalog.parent)
+    manager = RecordingManager()
+
+    with pytest.raises(ValueError):
+        add_data.remove_from_catalog(manager, **kwargs)
+
+    assert files_under(catalog.parent) == before
+    assert manager.calls == []
+
+
+def test_category_folder_is_not_a_flat_group(catalog):
+    manager = RecordingManager()
+
+    result = add_data.remove_from_catalog(manager, "shoes")
+
+    assert result["deleted_file_count"] == 0
+    assert "shoes/boot/0.jpg" in files_under(catalog)
+
+
+def test_group_removed_from_every_category(catalog):
+    result = add_data.remove_from_catalog(RecordingManager(), "red")
+
+    assert result["deleted_file_count"] == 3
+    assert files_under(catalog) == ["bags/tote/0.jpg", "shoes/boot/0.jpg"]
+
+
+def test_group_removed_from_one_category(catalog):
+    manager = RecordingManager()
+
+    add_data.remove_from_catalog(manager, "red", category="shoes")
+
+    assert files_under(catalog) == ["bags/tote/0.jpg", "red/0.jpg", "red/1.jpg", "shoes/boot/0.jpg"]
+    assert manager.calls == [("name_key", "red", "shoes")]
+
+
+def test_single_file_removed_and_forgotten(catalog, tmp_path):
+    manifest = ImportManifest(str(tmp_path / "manifest.db"))
+    manifest.record([("red/0.jpg", 1, 0.0, "a", [1]), ("red/1.jpg", 1, 0.0, "b", [2])])
+
+    result = add_data.remove_from_catalog(RecordingManager(), "red", filename="0.jpg")
+
+    assert result["deleted_file_count"] == 1
+    assert not (catalog / "red" / "0.jpg").exists()
+    assert sorted(manifest.entries()) == ["red/1.jpg"]
@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MILVUS_DB_PATH = os.getenv("MILVUS_DB_PATH", "./milvus.db")
+MILVUS_BROKER_FILE = os.getenv("MILVUS_BROKER_FILE", "./milvus.broker.json")
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def read_broker_uri(broker_file=MILVUS_BROKER_FILE):
+    """Returns the URI of the running vector-store broker, or None if there is none."""
+    try:
+        with open(broker_file) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info["uri"] if pid_alive(info["pid"]) else None
+
+def serve(db_path=MILVUS_DB_PATH, broker_file=MILVUS_BROKER_FILE, watch_parent=False):
+    """
+    Owns the milvus-lite file in this process and serves insert/search/query/
+    delete to local clients over milvus-lite's gRPC endpoint. The endpoint is
+    published in `broker_file` so API workers and CLI tools can connect.
+    """
+    if read_broker_uri(broker_file):
+        sys.exit(f"A vector-store broker is already running (see {broker_file})")
+
+    from milvus_lite.server_manager import server_manager_instance
+
+    uri = server_manager_instance.start_and_get_uri(db_path)
+    if uri is None:
+        sys.exit(f"Could not open milvus-lite database '{db_path}'")
+
+    with open(broker_file + ".tmp", "w") as f:
+        json.dump({"uri": uri, "pid": os.getpid(), "db_path": os.path.abspath(db_path)}, f)
+    os.replace(broker_file + ".tmp", broker_file)
+    print(f">>> Vector store serving '{db_path}' at {uri}", flush=True)
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    parent = os.getppid()
+    try:
+        while not watch_parent or os.getppid() == parent:
+            time.sleep(1)
+    finally:
+        if os.path.exists(broker_file):
+            os.remove(broker_file)
+
+def start_broker(db_path=MILVUS_DB_PATH, broker_file=MILVUS_BROKER_FILE, timeout: float = 60):
+    """
+    Starts a broker child process that exits with its parent and returns
+    `(process, uri)`. milvus-lite lets only one process open the file, so every
+    other process connects to `uri` instead.
+    """
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve",
+                                "--db-path", db_path, "--broker-file", broker_file, "--watch-parent"])
+    deadline = time.monotonic() + timeout
+    while True:
+        uri = read_broker_uri(broker_file)
+        if uri:
+            return process, uri
+        if process.poll() is not None:
+            raise RuntimeError(f"Vector-store broker exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise TimeoutError(f"Vector-store broker did not start within {timeout}s")
+        time.sleep(0.1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local vector-store broker owning the milvus-lite database.")
+    parser.add_argument("command", choices=["serve", "status"])
+    parser.add_argument("--db-path", default=MILVUS_DB_PATH)
+    parser.add_argument("--broker-file", default=MILVUS_BROKER_FILE)
+    parser.add_argument("--watch-parent", action="store_true", help="exit when the parent process exits")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.db_path, args.broker_file, args.watch_parent)
+    else:
+        uri = read_broker_uri(args.broker_file)
+        print(f"Broker running at {uri}" if uri else "No broker running.")